@@ -5,10 +5,23 @@ Created on Fri Apr 25 00:50:02 2025
 @author: Dr. Boaz Ron Zohar
 """
 
-import pygame
-import math
+import os
 import sys
 
+from galaxy_sim import headless
+from galaxy_sim.checkpoint import load_checkpoint, save_checkpoint
+from galaxy_sim.diagnostics import angular_momentum, kinetic_energy
+from galaxy_sim.encounters import close_pairs, merge_encounters
+from galaxy_sim.engines import make_engine, storage_dtype
+from galaxy_sim.gravity import force_error
+from galaxy_sim.integrators import make_integrator
+from galaxy_sim.particles import Particles
+from galaxy_sim.profiler import Profiler
+from galaxy_sim.scene import (add_layer_body, build_disk, color_index, make_layers,
+                              remove_layer_body)
+from galaxy_sim.trajectory import TrajectoryWriter
+from galaxy_sim.worker import PhysicsWorker
+
 # Default constants
 dt = 0.5
 Epsilon = 50              # minimum distance modifier
@@ -20,10 +33,51 @@ speed_multiplier_default = 1.0  # default speed multiplier
 Sun_Mass = 1              # base solar mass
 Layer_Factor = 3          # Layers density scaling
 NUM = 20                  # Number of bodies per layer
+Disk_Profile = "rings"    # body placement: "rings" (the layers), "exponential" or "plummer"
+Disk_Scale = 100          # radial scale of the exponential / Plummer profiles
+Equilibrium = False       # rings: circular speeds from the enclosed mass, not the layer table
+Engine = "direct"         # force engine: "direct", "barnes-hut", "parallel" or "particle-mesh"
+Theta = 0.5               # Barnes-Hut opening angle (smaller = more accurate)
+Workers = 0               # processes for the "parallel" engine (0 = one per core)
+Grid = 256                # particle-mesh cells per side (larger = more accurate)
+Integrator = "euler"      # time integrator: "euler", "leapfrog", "verlet" or "block"
+Precision = "float64"     # "float32" halves the body memory, "mixed" adds float64 force sums
+Capture_Radius = 0        # bodies closer than this count as a close encounter (0 = not checked)
+Merge_Bodies = False      # merge close encounters into one body (mass and momentum conserved)
+Diagnostics_Every = 1     # steps between energy/momentum updates (0 = no diagnostics)
+Checkpoint_File = "galaxy_checkpoint.gsc"  # S saves, L reloads; also written on exit
+Checkpoint_Every = 0      # steps between automatic checkpoints (0 = only on exit)
+Trajectory_File = None    # e.g. "galaxy.traj" to record the run for later analysis
+Trajectory_Every = 10     # steps between recorded frames
+Trajectory_Float32 = False  # store frames as float32 (half the disk space)
+Physics_Thread = True     # step the physics on a background thread, apart from drawing
+Substeps = 1              # physics steps per displayed frame
+Interpolate = False       # blend the last two snapshots when physics is slower than drawing
+Profile = False           # show the per-phase timing overlay from the start (T toggles it)
+Profile_CSV = None        # e.g. "timings.csv" to log every frame's phase timings
+WIDTH, HEIGHT = 1500, 1000
+
+# Headless batch mode: settings from the command line, no display or frame cap
+if "--headless" in sys.argv:
+    headless.main(sys.argv[1:], {
+        "G": G_default, "center_mass": mass_center_default,
+        "speed_mult": speed_multiplier_default, "dt": dt, "epsilon": Epsilon,
+        "layer_factor": Layer_Factor, "bodies_per_layer": NUM,
+        "engine": Engine, "theta": Theta, "workers": Workers, "grid": Grid,
+        "integrator": Integrator, "precision": Precision,
+        "capture_radius": Capture_Radius, "merge": Merge_Bodies,
+        "sun_mass": Sun_Mass, "g_factor": G_Factor,
+        "center": (WIDTH // 2, HEIGHT // 2), "output": "galaxy_final.npz",
+    })
+    sys.exit()
+
+import pygame
+
+from galaxy_sim.draw import BodyPainter
+from galaxy_sim.ui import DirtyScreen, StaticLayer, TextCache
 
 # Initialize Pygame
 pygame.init()
-WIDTH, HEIGHT = 1500, 1000
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 clock = pygame.time.Clock()
 font = pygame.font.SysFont(None, 24)
@@ -125,7 +179,7 @@ paused = False
 # │                            Color Index Table                            │
 # └───────────────────────────────────────────────────────────────────────────┘
 #
-# Body Colors (Mass_1 … Mass_26):
+# Body Colors (masses 1 … 26 × Sun_Mass):
 # | Index | RGB Tuple      | Color Name     |
 # |-------|----------------|----------------|
 # | 1     | (255,   0,   0) | Red            |
@@ -166,7 +220,7 @@ paused = False
 # | Spread Layers     | (255, 255,   0) | Yellow           |
 # | Settings button   | (128, 128,   0) | Dark Khaki       |
 
-# Precompute colors and mass mapping
+# Body colours, indexed by mass (see color_index)
 colors = [
     (255,   0,   0), (255,  50,   0), (255, 101,   0), (255, 152,   0),
     (255, 203,   0), (255, 254,   0), (204, 255,   0), (153, 255,   0),
@@ -177,78 +231,58 @@ colors = [
     (203,   0, 255), (254,   0, 255),
 ]
 
-Mass_1  =  1 * Sun_Mass
-Mass_2  =  2 * Sun_Mass
-Mass_3  =  3 * Sun_Mass
-Mass_4  =  4 * Sun_Mass
-Mass_5  =  5 * Sun_Mass
-Mass_6  =  6 * Sun_Mass
-Mass_7  =  7 * Sun_Mass
-Mass_8  =  8 * Sun_Mass
-Mass_9  =  9 * Sun_Mass
-Mass_10 = 10 * Sun_Mass
-Mass_11 = 11 * Sun_Mass
-Mass_12 = 12 * Sun_Mass
-Mass_13 = 13 * Sun_Mass
-Mass_14 = 14 * Sun_Mass
-Mass_15 = 15 * Sun_Mass
-Mass_16 = 16 * Sun_Mass
-Mass_17 = 17 * Sun_Mass
-Mass_18 = 18 * Sun_Mass
-Mass_19 = 19 * Sun_Mass
-Mass_20 = 20 * Sun_Mass
-Mass_21 = 21 * Sun_Mass
-Mass_22 = 22 * Sun_Mass
-Mass_23 = 23 * Sun_Mass
-Mass_24 = 24 * Sun_Mass
-Mass_25 = 25 * Sun_Mass
-Mass_26 = 26 * Sun_Mass
-
-color_to_mass = {c: globals()[f"Mass_{i+1}"] for i, c in enumerate(colors)}
-
-# Define.layers and apply user multiplier
-layers = [
-    {"num": NUM, "radius": 10*Layer_Factor, "speed": 10.0*G_Factor},
-    {"num": NUM, "radius": 20*Layer_Factor, "speed":  8.2*G_Factor},
-    {"num": NUM, "radius": 30*Layer_Factor, "speed":  7.1*G_Factor},
-    {"num": NUM, "radius": 40*Layer_Factor, "speed":  6.3*G_Factor},
-    {"num": NUM, "radius": 50*Layer_Factor, "speed":  5.8*G_Factor},
-    {"num": NUM, "radius": 60*Layer_Factor, "speed":  5.2*G_Factor},
-    {"num": NUM, "radius": 70*Layer_Factor, "speed":  4.6*G_Factor},
-    {"num": NUM, "radius": 80*Layer_Factor, "speed":  4.0*G_Factor},
-    {"num": NUM, "radius": 90*Layer_Factor, "speed":  3.5*G_Factor},
-    {"num": NUM, "radius":100*Layer_Factor, "speed":  3.0*G_Factor},
-]
-for layer in layers:
-    layer["speed"] *= speed_multiplier
-
-# Prepare bodies
-positions, velocities, masses = [], [], []
-color_index = 0
-
-def create_bodies(num, radius, speed):
-    global color_index
-    for i in range(num):
-        angle = (2 * math.pi / num) * i + math.pi / num
-        x = center_x + radius * math.cos(angle)
-        y = center_y + radius * math.sin(angle)
-        vx = -speed * math.sin(angle)
-        vy =  speed * math.cos(angle)
-        positions.append((x, y))
-        velocities.append((vx, vy))
-        color = colors[color_index % len(colors)]
-        masses.append(color_to_mass[color])
-        color_index += 1
-
-# Initialize system
-for layer in layers:
-    create_bodies(layer["num"], layer["radius"], layer["speed"])  
-# add central mass
-positions.append((center_x, center_y))
-velocities.append((0, 0))
-masses.append(mass_center)
-
-num_bodies = len(positions)
+body_painter = BodyPainter(screen, colors, radius=5)
+
+# Define layers and apply user multiplier
+layers = make_layers(NUM, Layer_Factor, speed_multiplier, G_Factor)
+
+def reset_bodies():
+    # Rebuild every layer plus the central mass in the body store
+    global step_count, stats, encounters, merged
+    bodies.clear()
+    bodies.extend(*build_disk(layers, center_x, center_y, mass_center, Sun_Mass,
+                              profile=Disk_Profile, scale=Disk_Scale, equilibrium=Equilibrium,
+                              speed_mult=speed_multiplier, G=G, epsilon=Epsilon))
+    step_count = 0
+    stats = None
+    encounters = merged = 0
+    integrator.reset()
+
+def change_layer(i, change):
+    # Add (+1) or remove (-1) one body of layer i; every other body keeps its motion
+    global stats
+    if change > 0:
+        changed = add_layer_body(bodies, layers, i, sun_mass=Sun_Mass) is not None
+    else:
+        changed = remove_layer_body(bodies, i)
+    if not changed:
+        return
+    layers[i]["num"] += change
+    stats = None
+    integrator.reset()
+
+def report_force_error():
+    # Print how far the approximate engine is from direct summation for this run
+    if Engine == "barnes-hut":
+        median, p99, worst = force_error(force_engine, bodies.positions, bodies.masses, G, Epsilon)
+        print(f"Barnes-Hut theta={Theta}: relative force error "
+              f"median {median:.1e}, p99 {p99:.1e}, max {worst:.1e}")
+    elif Engine == "particle-mesh":
+        median, p99, worst = force_error(force_engine, bodies.positions, bodies.masses, G, Epsilon)
+        print(f"Particle mesh {Grid}x{Grid}: relative force error "
+              f"median {median:.1e}, p99 {p99:.1e}, max {worst:.1e}")
+
+# Initialize system: bodies in one growable structure-of-arrays store
+bodies = Particles(dtype=storage_dtype(Precision))
+profiler = Profiler(csv_path=Profile_CSV, enabled=Profile)
+force_engine = profiler.wrap("forces", make_engine(Engine, theta=Theta, workers=Workers, grid=Grid,
+                                                   precision=Precision))
+integrator = make_integrator(Integrator, force_engine)
+# The engine's worker processes are forked before any thread starts
+trajectory = TrajectoryWriter(Trajectory_File, Trajectory_Every, Trajectory_Float32) \
+    if Trajectory_File else None
+reset_bodies()
+report_force_error()
 
 # UI button rectangles
 pause_button_rect    = pygame.Rect(20,  50, 120, 40)
@@ -264,44 +298,119 @@ for i in range(len(layers)):
     add_buttons.append(pygame.Rect(20, y, 30, 30))
     remove_buttons.append(pygame.Rect(60, y, 30, 30))
 
-def draw_button(rect, text, color):
-    pygame.draw.rect(screen, color, rect)
-    pygame.draw.rect(screen, (255, 255, 255), rect, 2)
-    screen.blit(font.render(text, True, (255, 255, 255)), (rect.x+10, rect.y+10))
+def draw_button(rect, text, color, surface=screen):
+    pygame.draw.rect(surface, color, rect)
+    pygame.draw.rect(surface, (255, 255, 255), rect, 2)
+    surface.blit(font.render(text, True, (255, 255, 255)), (rect.x+10, rect.y+10))
 
-def draw_layer_buttons():
+def draw_layer_buttons(surface=screen):
     for i in range(len(layers)):
-        pygame.draw.rect(screen, (0, 255, 0), add_buttons[i])
-        pygame.draw.rect(screen, (255, 0,   0), remove_buttons[i])
-        screen.blit(font.render("+", True, (0,0,0)), (add_buttons[i].x + 8, add_buttons[i].y + 5))
-        screen.blit(font.render("-", True, (0,0,0)), (remove_buttons[i].x + 9, remove_buttons[i].y + 5))
-
-def gravitational_force(x1, y1, x2, y2, m1, m2):
-    dx = x2 - x1
-    dy = y2 - y1
-    r = math.hypot(dx, dy)
-    if r == 0:
-        return 0, 0
-    f = G * m1 * m2 / ((r + Epsilon)**2)
-    return f * dx / r, f * dy / r
-
-def angular_momentum(x, y, vx, vy, m, cx, cy):
-    rx, ry = x - cx, y - cy
-    return m * (rx * vy - ry * vx)
-
-def kinetic_energy(m, vx, vy):
-    return 0.5 * m * (vx**2 + vy**2)
-
-def potential_energy(x1, y1, x2, y2, m1, m2):
-    r = math.hypot(x2 - x1, y2 - y1)
-    if r == 0:
-        return 0
-    return -G * m1 * m2 / (r + Epsilon)
+        pygame.draw.rect(surface, (0, 255, 0), add_buttons[i])
+        pygame.draw.rect(surface, (255, 0,   0), remove_buttons[i])
+        surface.blit(font.render("+", True, (0,0,0)), (add_buttons[i].x + 8, add_buttons[i].y + 5))
+        surface.blit(font.render("-", True, (0,0,0)), (remove_buttons[i].x + 9, remove_buttons[i].y + 5))
+
+def paint_controls(surface):
+    # Draw every control once into the cached UI layer; returns their areas
+    draw_button(pause_button_rect,    "Pause",           (255,   0,   0), surface)
+    draw_button(restart_button_rect,  "Restart",         (  0, 255,   0), surface)
+    draw_button(compress_button_rect, "Compress Layers", (  0,   0, 255), surface)
+    draw_button(spread_button_rect,   "Spread Layers",   (255, 101,   0), surface)
+    draw_layer_buttons(surface)
+    draw_button(settings_button_rect, "Settings", (254, 0, 255), surface)
+    return [pause_button_rect, restart_button_rect, compress_button_rect, spread_button_rect,
+            settings_button_rect] + add_buttons + remove_buttons
+
+# Controls are painted once, HUD text is rendered once per distinct string,
+# and only the regions drawn in this or the last frame reach the display
+ui_layer = StaticLayer((WIDTH, HEIGHT), paint_controls)
+hud_text = TextCache(font)
+dirty = DirtyScreen(screen)
+
+def sample_stats(potential):
+    # Record angular momentum, kinetic and potential energy at one instant
+    global stats
+    stats = (angular_momentum(bodies.positions, bodies.velocities, bodies.masses, center_x, center_y),
+             kinetic_energy(bodies.velocities, bodies.masses), potential)
+
+def save_state():
+    # Write bodies, settings and step count to the binary checkpoint
+    save_checkpoint(Checkpoint_File, bodies.positions, bodies.velocities, bodies.masses,
+                    layer=bodies.layer,
+                    G=G, dt=dt, epsilon=Epsilon, layers=layers, step=step_count,
+                    mass_center=mass_center, speed_multiplier=speed_multiplier,
+                    layer_factor=Layer_Factor, num=NUM)
+    print(f"Checkpoint at step {step_count} written to {Checkpoint_File}")
+
+def load_state():
+    # Continue from the checkpoint instead of regenerating the disk. The file
+    # is read and checked in full first, so a bad one leaves the run as it is;
+    # settings it lacks (headless checkpoints, older files) keep their values.
+    global step_count, stats, encounters, merged
+    global G, dt, Epsilon, layers, mass_center, speed_multiplier, Layer_Factor, NUM
+    if not os.path.exists(Checkpoint_File):
+        print(f"No checkpoint at {Checkpoint_File}")
+        return
+    try:
+        arrays, saved = load_checkpoint(Checkpoint_File)
+    except (OSError, ValueError) as error:
+        print(f"Cannot load {Checkpoint_File}: {error}")
+        return
+    bodies.clear()
+    bodies.extend(arrays["positions"], arrays["velocities"], arrays["masses"], arrays.get("layer"))
+    G, dt, Epsilon = saved.get("G", G), saved.get("dt", dt), saved.get("epsilon", Epsilon)
+    step_count, layers = saved.get("step", step_count), saved.get("layers", layers)
+    mass_center = saved.get("mass_center", mass_center)
+    speed_multiplier = saved.get("speed_multiplier", speed_multiplier)
+    Layer_Factor, NUM = saved.get("layer_factor", Layer_Factor), saved.get("num", NUM)
+    stats = None
+    encounters = merged = 0
+    integrator.reset()
+
+def physics_step():
+    # One step of the simulation; runs on the physics thread
+    global step_count
+    # Potential energy comes out of the step's force pass; the integrator
+    # reports it when positions and velocities describe the same instant
+    sample = Diagnostics_Every > 0 and step_count % Diagnostics_Every == 0
+    profiler.call("update", integrator.step,
+                  bodies.positions, bodies.velocities, bodies.masses, G, dt, Epsilon,
+                  on_potential=profiler.wrap("stats", sample_stats) if sample else None)
+    step_count += 1
+    profiler.count_step()
+    if Capture_Radius > 0:
+        profiler.call("update", handle_encounters)
+    if Checkpoint_Every > 0 and step_count % Checkpoint_Every == 0:
+        save_state()
+    if trajectory is not None:
+        trajectory.write(step_count, bodies.positions, bodies.velocities, bodies.masses)
+
+def handle_encounters():
+    # Close pairs from the spatial grid: counted, or merged into single bodies
+    global encounters, merged
+    if not Merge_Bodies:
+        encounters = len(close_pairs(bodies.positions, Capture_Radius)[0])
+        return
+    count = merge_encounters(bodies, Capture_Radius)
+    if count:
+        merged += count
+        integrator.reset()
+
+def take_snapshot():
+    # What the display needs, copied (only a reset while paused needs a fresh stats pass)
+    if Diagnostics_Every > 0 and stats is None:
+        sample_stats(force_engine(bodies.positions, bodies.masses, G, Epsilon, potential=True)[1])
+    return bodies.positions.copy(), (stats, color_index(bodies.masses, Sun_Mass))
+
+# Physics runs Substeps steps per frame on its own thread; the loop below
+# draws the latest finished snapshot and changes the state only while held
+physics = PhysicsWorker(physics_step, take_snapshot, Substeps, threaded=Physics_Thread)
 
 # Main simulation loop
 running = True
 while running:
-    screen.fill((0, 0, 0))
+    profiler.begin()
+    dirty.begin()
 
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
@@ -312,6 +421,14 @@ while running:
                 paused = not paused
             elif event.key == pygame.K_r and paused:
                 paused = False
+            elif event.key == pygame.K_t:
+                profiler.toggle()
+            elif event.key == pygame.K_s:
+                with physics.hold():
+                    save_state()
+            elif event.key == pygame.K_l:
+                with physics.hold():
+                    load_state()
 
         elif event.type == pygame.MOUSEBUTTONDOWN:
             mouse_pos = event.pos
@@ -320,146 +437,98 @@ while running:
                 paused = not paused
 
             elif restart_button_rect.collidepoint(mouse_pos):
-                positions.clear(); velocities.clear(); masses.clear(); color_index = 0
-                for layer in layers:
-                    create_bodies(layer["num"], layer["radius"], layer["speed"])
-                positions.append((center_x, center_y)); velocities.append((0,0)); masses.append(mass_center)
+                with physics.hold():
+                    reset_bodies()
                 paused = False
 
             elif compress_button_rect.collidepoint(mouse_pos):
-                for layer in layers:
-                    layer["radius"] *= 0.9
-                positions.clear(); velocities.clear(); masses.clear(); color_index = 0
-                for layer in layers:
-                    create_bodies(layer["num"], layer["radius"], layer["speed"])
-                positions.append((center_x, center_y)); velocities.append((0,0)); masses.append(mass_center)
+                with physics.hold():
+                    for layer in layers:
+                        layer["radius"] *= 0.9
+                    reset_bodies()
                 #paused = False
 
             elif spread_button_rect.collidepoint(mouse_pos):
-                for layer in layers:
-                    layer["radius"] *= 1.1
-                positions.clear(); velocities.clear(); masses.clear(); color_index = 0
-                for layer in layers:
-                    create_bodies(layer["num"], layer["radius"], layer["speed"])
-                positions.append((center_x, center_y)); velocities.append((0,0)); masses.append(mass_center)
+                with physics.hold():
+                    for layer in layers:
+                        layer["radius"] *= 1.1
+                    reset_bodies()
                 #paused = False
 
             elif settings_button_rect.collidepoint(mouse_pos):
-                # call the settings screen again
-                G, mass_center, speed_multiplier, dt, Epsilon, Layer_Factor, NUM = show_start_screen()
-
-                # update layers with new parameters
-                layers = [
-                    {"num": NUM, "radius": 10*Layer_Factor, "speed": 10.0*G_Factor},
-                    {"num": NUM, "radius": 20*Layer_Factor, "speed":  8.2*G_Factor},
-                    {"num": NUM, "radius": 30*Layer_Factor, "speed":  7.1*G_Factor},
-                    {"num": NUM, "radius": 40*Layer_Factor, "speed":  6.3*G_Factor},
-                    {"num": NUM, "radius": 50*Layer_Factor, "speed":  5.8*G_Factor},
-                    {"num": NUM, "radius": 60*Layer_Factor, "speed":  5.2*G_Factor},
-                    {"num": NUM, "radius": 70*Layer_Factor, "speed":  4.6*G_Factor},
-                    {"num": NUM, "radius": 80*Layer_Factor, "speed":  4.0*G_Factor},
-                    {"num": NUM, "radius": 90*Layer_Factor, "speed":  3.5*G_Factor},
-                    {"num": NUM, "radius":100*Layer_Factor, "speed":  3.0*G_Factor},
-                ]
-                for layer in layers:
-                    layer["speed"] *= speed_multiplier
-
-                positions.clear(); velocities.clear(); masses.clear(); color_index = 0
-                for layer in layers:
-                    create_bodies(layer["num"], layer["radius"], layer["speed"])
-                positions.append((center_x, center_y)); velocities.append((0,0)); masses.append(mass_center)
-                num_bodies = len(positions)
+                with physics.hold():
+                    # call the settings screen again
+                    G, mass_center, speed_multiplier, dt, Epsilon, Layer_Factor, NUM = show_start_screen()
+
+                    # update layers with new parameters
+                    layers = make_layers(NUM, Layer_Factor, speed_multiplier, G_Factor)
+
+                    reset_bodies()
+                    report_force_error()
+                ui_layer.invalidate()
+                dirty.invalidate()
                 paused = False
 
             else:
                 # layer + / - buttons
                 for i in range(len(layers)):
                     if add_buttons[i].collidepoint(mouse_pos):
-                        layers[i]["num"] += 1
+                        change = 1
                     elif remove_buttons[i].collidepoint(mouse_pos) and layers[i]["num"] > 0:
-                        layers[i]["num"] -= 1
+                        change = -1
                     else:
                         continue
-                    positions.clear(); velocities.clear(); masses.clear(); color_index = 0
-                    for layer in layers:
-                        create_bodies(layer["num"], layer["radius"], layer["speed"])
-                    positions.append((center_x, center_y)); velocities.append((0,0)); masses.append(mass_center)
-                    num_bodies = len(positions)
+                    with physics.hold():
+                        change_layer(i, change)
                     break
 
-    # Physics update
-    if not paused:
-        forces = [(0,0)] * num_bodies
-        for i in range(num_bodies):
-            fx_total, fy_total = 0, 0
-            for j in range(num_bodies):
-                if i != j:
-                    fx, fy = gravitational_force(
-                        positions[i][0], positions[i][1],
-                        positions[j][0], positions[j][1],
-                        masses[i], masses[j]
-                    )
-                    fx_total += fx
-                    fy_total += fy
-            forces[i] = (fx_total, fy_total)
-
-        for i in range(num_bodies):
-            vx, vy = velocities[i]
-            fx, fy = forces[i]
-            velocities[i] = (vx + fx / masses[i] * dt, vy + fy / masses[i] * dt)
-
-        for i in range(num_bodies):
-            x, y = positions[i]
-            vx, vy = velocities[i]
-            positions[i] = (x + vx * dt, y + vy * dt)
-
-    # Draw bodies
-    for i in range(num_bodies):
-        pygame.draw.circle(
-            screen,
-            colors[i % len(colors)],
-            (int(positions[i][0]), int(positions[i][1])),
-            5
-        )
+    profiler.lap("events")
 
-    # Draw UI
-    draw_button(pause_button_rect,    "Pause",           (255,   0,   0))
-    draw_button(restart_button_rect,  "Restart",         (  0, 255,   0))
-    draw_button(compress_button_rect, "Compress Layers", (  0,   0, 255))
-    draw_button(spread_button_rect,   "Spread Layers",   (255, 101,   0))
-    draw_layer_buttons()
-    draw_button(settings_button_rect, "Settings", (254, 0, 255))
-
-    # Stats display
-    L = sum(
-        angular_momentum(
-            positions[i][0], positions[i][1],
-            velocities[i][0], velocities[i][1],
-            masses[i], center_x, center_y
-        )
-        for i in range(num_bodies)
-    )
-    KE = sum(kinetic_energy(masses[i], velocities[i][0], velocities[i][1])
-             for i in range(num_bodies))
-    PE = sum(
-        potential_energy(
-            positions[i][0], positions[i][1],
-            positions[j][0], positions[j][1],
-            masses[i], masses[j]
+    # Physics update (the next Substeps steps, on the physics thread)
+    if not paused:
+        physics.request()
+
+    # Draw bodies from the latest snapshot (all in one batched write, colour
+    # from mass: bodies change places when one is removed)
+    _, shown, (shown_stats, shown_colors) = physics.latest()
+    if Interpolate:
+        shown = physics.interpolate()
+    dirty.add(body_painter.draw(shown, shown_colors))
+
+    # Draw UI (opaque and unchanging: it covers the bodies but never needs erasing)
+    ui_layer.blit(screen)
+
+    # Stats display (the last sample, taken with the snapshot)
+    if Diagnostics_Every > 0:
+        L, KE, PE = shown_stats
+        stats_text = hud_text.render(
+            f"Angular momentum: {L:.0f} | Total energy: {KE+PE:.0f} | "
+            f"Kinetic: {KE:.0f} | Potential: {PE:.0f}"
         )
-        for i in range(num_bodies) for j in range(i+1, num_bodies)
-    )
-    stats_text = font.render(
-        f"Angular momentum: {L:.0f} | Total energy: {KE+PE:.0f} | "
-        f"Kinetic: {KE:.0f} | Potential: {PE:.0f}",
-        True, (255, 255, 255)
-    )
-    screen.blit(stats_text, (10, 10))
-    sat_count = num_bodies - 1
-    count_text = font.render(f"Satellites: {sat_count}", True, (255, 255, 255))
-    screen.blit(count_text, (10, 30))
-
-    pygame.display.flip()
+        dirty.add(screen.blit(stats_text, (10, 10)))
+    sat_count = len(shown) - 1
+    # The encounter counters are set by the physics thread, at most a batch ahead
+    if Capture_Radius > 0 and Merge_Bodies:
+        count_text = hud_text.render(f"Satellites: {sat_count} | Merged: {merged}")
+    elif Capture_Radius > 0:
+        count_text = hud_text.render(f"Satellites: {sat_count} | Close encounters: {encounters}")
+    else:
+        count_text = hud_text.render(f"Satellites: {sat_count}")
+    dirty.add(screen.blit(count_text, (10, 30)))
+
+    # Phase timings of the last frames
+    if profiler.enabled:
+        for k, line in enumerate(profiler.summary()):
+            dirty.add(screen.blit(hud_text.render(line), (WIDTH - 330, 50 + 20 * k)))
+
+    dirty.end()
+    profiler.lap("draw")
+    profiler.end_frame(len(shown))
     clock.tick(60)
 
+physics.stop()
+profiler.close()
+save_state()
+if trajectory is not None:
+    trajectory.close()
 pygame.quit()
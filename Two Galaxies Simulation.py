@@ -11,10 +11,23 @@ Created on Mon Apr 28 2025
 Two-Galaxy Gravitational Simulation with UI Controls, Mass-Based Colors and Draggable Centers
 """
 
-import pygame
 import math
+import os
 import sys
 
+from galaxy_sim import headless
+from galaxy_sim.checkpoint import load_checkpoint, save_checkpoint
+from galaxy_sim.encounters import close_pairs, merge_encounters
+from galaxy_sim.engines import make_engine, storage_dtype
+from galaxy_sim.gravity import force_error
+from galaxy_sim.integrators import make_integrator
+from galaxy_sim.particles import Particles
+from galaxy_sim.profiler import Profiler
+from galaxy_sim.scene import (add_layer_body, build_disk, color_index, galaxy_centers,
+                              make_layers, remove_layer_body)
+from galaxy_sim.trajectory import TrajectoryWriter
+from galaxy_sim.worker import PhysicsWorker
+
 # -------------------- Default constants --------------------
 dt = 0.5                      # time step
 epsilon = 50                  # softening distance
@@ -26,11 +39,53 @@ speed_multiplier_default = 1.0# default speed multiplier
 sun_mass = 1                  # base solar mass
 layer_factor = 3              # layers density scaling
 num_per_layer = 20            # number of bodies per layer
+disk_profile = "rings"        # body placement: "rings" (the layers), "exponential" or "plummer"
+disk_scale = 100              # radial scale of the exponential / Plummer profiles
+equilibrium = False           # rings: circular speeds from the enclosed mass, not the layer table
 center_radius = 8             # display radius for galaxy center for dragging detection
+num_galaxies = 2              # galaxies in the scene, spaced by the intergalactic distance
+engine = "direct"             # force engine: "direct", "barnes-hut", "parallel" or "particle-mesh"
+theta = 0.5                   # Barnes-Hut opening angle (smaller = more accurate)
+workers = 0                   # processes for the "parallel" engine (0 = one per core)
+grid = 256                    # particle-mesh cells per side (larger = more accurate)
+integrator_name = "euler"     # time integrator: "euler", "leapfrog", "verlet" or "block"
+precision = "float64"         # "float32" halves the body memory, "mixed" adds float64 force sums
+capture_radius = 0            # bodies closer than this count as a close encounter (0 = not checked)
+merge_bodies = False          # merge close encounters into one body (mass and momentum conserved)
+checkpoint_file = "two_galaxies_checkpoint.gsc"  # S saves, L reloads; also written on exit
+checkpoint_every = 0          # steps between automatic checkpoints (0 = only on exit)
+trajectory_file = None        # e.g. "two_galaxies.traj" to record the run for later analysis
+trajectory_every = 10         # steps between recorded frames
+trajectory_float32 = False    # store frames as float32 (half the disk space)
+physics_thread = True         # step the physics on a background thread, apart from drawing
+substeps = 1                  # physics steps per displayed frame
+interpolate = False           # blend the last two snapshots when physics is slower than drawing
+profile = False               # show the per-phase timing overlay from the start (T toggles it)
+profile_csv = None            # e.g. "timings.csv" to log every frame's phase timings
+WIDTH, HEIGHT = 1500, 1000
+
+# ------------------ Headless batch mode ------------------
+if "--headless" in sys.argv:
+    headless.main(sys.argv[1:], {
+        "G": G_default, "center_mass": mass_center_default,
+        "speed_mult": speed_multiplier_default, "dt": dt, "epsilon": epsilon,
+        "layer_factor": layer_factor, "bodies_per_layer": num_per_layer,
+        "intergalactic_dist": 200.0, "galaxies": num_galaxies,
+        "engine": engine, "theta": theta, "workers": workers, "grid": grid,
+        "integrator": integrator_name, "precision": precision,
+        "capture_radius": capture_radius, "merge": merge_bodies,
+        "sun_mass": sun_mass, "g_factor": G_factor,
+        "center": (WIDTH // 2, HEIGHT // 2), "output": "two_galaxies_final.npz",
+    }, two_galaxies=True)
+    sys.exit()
+
+import pygame
+
+from galaxy_sim.draw import BodyPainter
+from galaxy_sim.ui import DirtyScreen, StaticLayer, TextCache
 
 # ------------------ Pygame initialization ------------------
 pygame.init()
-WIDTH, HEIGHT = 1500, 1000
 screen = pygame.display.set_mode((WIDTH, HEIGHT))
 clock = pygame.time.Clock()
 font = pygame.font.SysFont(None, 24)
@@ -102,24 +157,21 @@ def show_start_screen():
 # Load parameters
 G, mass_center, speed_multiplier, dt, epsilon, layer_factor, num_per_layer, inter_dist = show_start_screen()
 # Define galaxy centers
-center1_x = WIDTH//2 - int(inter_dist/2); center1_y = HEIGHT//2
-center2_x = WIDTH//2 + int(inter_dist/2); center2_y = HEIGHT//2
-# Flags for dragging
-dragging1 = dragging2 = False
+centers = [list(c) for c in galaxy_centers(num_galaxies, WIDTH//2, HEIGHT//2, inter_dist)]
+center_colors = [(255,255,255),(255,255,0)]
+# Index of the center being dragged (None when not dragging)
+dragging = None
 offset_x = offset_y = 0
 
-# Color table and mapping
+# Color table, indexed by mass (see color_index)
 colors = [(255,0,0),(255,50,0),(255,101,0),(255,152,0),(255,203,0),(255,254,0),
           (204,255,0),(153,255,0),(102,255,0),(51,255,0),(0,255,0),(0,255,50),
           (0,255,101),(0,255,152),(0,255,203),(0,255,254),(0,204,255),(0,153,255),
           (0,102,255),(0,51,255),(0,0,255),(50,0,255),(101,0,255),(152,0,255),
           (203,0,255),(254,0,255)]
-Masses = [(i+1)*sun_mass for i in range(len(colors))]
-color_to_mass = {c: m for c, m in zip(colors, Masses)}
+body_painter = BodyPainter(screen, colors, radius=5)
 # Layers
-layers = [{"num": num_per_layer, "radius": r*layer_factor, "speed": s*G_factor} for r,s in
-          [(10,10.0),(20,8.2),(30,7.1),(40,6.3),(50,5.8),(60,5.2),(70,4.6),(80,4.0),(90,3.5),(100,3.0)]]
-for layer in layers: layer['speed']*=speed_multiplier
+layers = make_layers(num_per_layer, layer_factor, speed_multiplier, G_factor)
 # UI elements
 pause_rect = pygame.Rect(20,50,120,40); restart_rect=pygame.Rect(20,100,120,40)
 compress_rect=pygame.Rect(20,150,180,40); spread_rect=pygame.Rect(20,200,180,40)
@@ -127,49 +179,145 @@ settings_rect=pygame.Rect(WIDTH-140,HEIGHT-60,120,40)
 add_btns=[pygame.Rect(20,250+i*35,30,30) for i in range(len(layers))]
 rem_btns=[pygame.Rect(60,250+i*35,30,30) for i in range(len(layers))]
 
-def draw_button(rect,text,color):
-    pygame.draw.rect(screen,color,rect); pygame.draw.rect(screen,(255,255,255),rect,2)
-    screen.blit(font.render(text,True,(255,255,255)),(rect.x+10,rect.y+10))
-def draw_layer_btns():
+def draw_button(rect,text,color,surface=screen):
+    pygame.draw.rect(surface,color,rect); pygame.draw.rect(surface,(255,255,255),rect,2)
+    surface.blit(font.render(text,True,(255,255,255)),(rect.x+10,rect.y+10))
+def draw_layer_btns(surface=screen):
     for i in range(len(layers)):
-        pygame.draw.rect(screen,(0,255,0),add_btns[i]); pygame.draw.rect(screen,(255,0,0),rem_btns[i])
-        screen.blit(font.render("+",True,(0,0,0)),(add_btns[i].x+8,add_btns[i].y+5))
-        screen.blit(font.render("-",True,(0,0,0)),(rem_btns[i].x+9,rem_btns[i].y+5))
-# Containers
-pos1,vel1,m1s=[],[],[]; pos2,vel2,m2s=[],[],[]; cidx=0
-# Create bodies
-def create_gal(center_x,center_y,pos,vel,mass,num,radius,speed):
-    global cidx
-    for i in range(num):
-        ang=2*math.pi/num*i+math.pi/num
-        x=center_x+radius*math.cos(ang); y=center_y+radius*math.sin(ang)
-        vx=-speed*math.sin(ang); vy=speed*math.cos(ang)
-        col=colors[cidx%len(colors)]; m=color_to_mass[col]
-        pos.append((x,y)); vel.append((vx,vy)); mass.append(m); cidx+=1
-# Init galaxies
+        pygame.draw.rect(surface,(0,255,0),add_btns[i]); pygame.draw.rect(surface,(255,0,0),rem_btns[i])
+        surface.blit(font.render("+",True,(0,0,0)),(add_btns[i].x+8,add_btns[i].y+5))
+        surface.blit(font.render("-",True,(0,0,0)),(rem_btns[i].x+9,rem_btns[i].y+5))
+# Controls painted once into a cached layer; only regions drawn this or last frame are updated
+def paint_controls(surface):
+    draw_button(pause_rect, "Pause", (255, 0, 0), surface)
+    draw_button(restart_rect, "Restart", (0, 255, 0), surface)
+    draw_button(compress_rect, "Compress", (0, 0, 255), surface)
+    draw_button(spread_rect, "Spread", (255, 255, 0), surface)
+    draw_layer_btns(surface)
+    draw_button(settings_rect, "Settings", (254, 0, 255), surface)
+    return [pause_rect, restart_rect, compress_rect, spread_rect, settings_rect] + add_btns + rem_btns
+ui_layer = StaticLayer((WIDTH, HEIGHT), paint_controls)
+dirty = DirtyScreen(screen)
+hud_text = TextCache(font)
+# Container: all galaxies in one growable structure-of-arrays body store;
+# bodies.galaxy[i] and bodies.layer[i] are the galaxy and layer of body i
+bodies=Particles(dtype=storage_dtype(precision))
+step_count=0
+# Init galaxies (each galaxy continues the colour sequence of the previous one)
 def init_gals():
-    global pos1,vel1,m1s,pos2,vel2,m2s,cidx,n1,n2
-    pos1,vel1,m1s,pos2,vel2,m2s=[],[],[],[],[],[]; cidx=0
-    for lay in layers: create_gal(center1_x,center1_y,pos1,vel1,m1s,lay['num'],lay['radius'],lay['speed'])
-    pos1.append((center1_x,center1_y)); vel1.append((0,0)); m1s.append(mass_center)
-    for lay in layers: create_gal(center2_x,center2_y,pos2,vel2,m2s,lay['num'],lay['radius'],lay['speed'])
-    pos2.append((center2_x,center2_y)); vel2.append((0,0)); m2s.append(mass_center)
-    n1,n2=len(pos1),len(pos2)
+    global step_count,encounters,merged
+    bodies.clear()
+    first_color=0
+    for g,(cx,cy) in enumerate(centers):
+        positions,velocities,masses,layer=build_disk(layers,cx,cy,mass_center,sun_mass,first_color,
+                                                     profile=disk_profile,scale=disk_scale,
+                                                     equilibrium=equilibrium,speed_mult=speed_multiplier,
+                                                     G=G,epsilon=epsilon,seed=g)
+        bodies.extend(positions,velocities,masses,layer,g)
+        first_color+=len(masses)-1
+    step_count=0
+    encounters=merged=0
+    integrator.reset()
+# +/- change one layer in every galaxy; the other bodies keep their motion
+def change_layer(i,change):
+    changed=False
+    for g in range(len(centers)):
+        if change>0:
+            changed|=add_layer_body(bodies,layers,i,g,sun_mass) is not None
+        else:
+            changed|=remove_layer_body(bodies,i,g)
+    if changed:
+        layers[i]['num']+=change
+        integrator.reset()
+# Checkpoints: bodies, settings, centres and step count in one binary file
+def save_state():
+    save_checkpoint(checkpoint_file,bodies.positions,bodies.velocities,bodies.masses,
+                    bodies.galaxy,bodies.layer,
+                    G=G,dt=dt,epsilon=epsilon,layers=layers,step=step_count,
+                    mass_center=mass_center,speed_multiplier=speed_multiplier,
+                    layer_factor=layer_factor,num=num_per_layer,centers=centers)
+    print(f"Checkpoint at step {step_count} written to {checkpoint_file}")
+def load_state():
+    global step_count
+    global G,dt,epsilon,mass_center,speed_multiplier,layer_factor,num_per_layer
+    global encounters,merged
+    if not os.path.exists(checkpoint_file):
+        print(f"No checkpoint at {checkpoint_file}")
+        return
+    # Checked in full before anything changes; missing settings keep their values
+    try:
+        arrays,saved=load_checkpoint(checkpoint_file)
+    except (OSError,ValueError) as error:
+        print(f"Cannot load {checkpoint_file}: {error}")
+        return
+    bodies.clear()
+    bodies.extend(arrays["positions"],arrays["velocities"],arrays["masses"],
+                  arrays.get("layer"),arrays.get("galaxy"))
+    G,dt,epsilon=saved.get("G",G),saved.get("dt",dt),saved.get("epsilon",epsilon)
+    step_count=saved.get("step",step_count)
+    mass_center=saved.get("mass_center",mass_center)
+    speed_multiplier=saved.get("speed_multiplier",speed_multiplier)
+    layer_factor,num_per_layer=saved.get("layer_factor",layer_factor),saved.get("num",num_per_layer)
+    layers[:]=saved.get("layers",layers)
+    centers[:]=[list(c) for c in saved.get("centers",centers)]
+    encounters=merged=0
+    integrator.reset()
+def report_force_error():
+    # Print how far the approximate engine is from direct summation for this run
+    if engine == "barnes-hut":
+        median, p99, worst = force_error(force_engine, bodies.positions, bodies.masses, G, epsilon)
+        print(f"Barnes-Hut theta={theta}: relative force error "
+              f"median {median:.1e}, p99 {p99:.1e}, max {worst:.1e}")
+    elif engine == "particle-mesh":
+        median, p99, worst = force_error(force_engine, bodies.positions, bodies.masses, G, epsilon)
+        print(f"Particle mesh {grid}x{grid}: relative force error "
+              f"median {median:.1e}, p99 {p99:.1e}, max {worst:.1e}")
+profiler = Profiler(csv_path=profile_csv, enabled=profile)
+force_engine = profiler.wrap("forces", make_engine(engine, theta=theta, workers=workers, grid=grid,
+                                                   precision=precision))
+integrator = make_integrator(integrator_name, force_engine)
+# The engine's worker processes are forked before any thread starts
+trajectory = TrajectoryWriter(trajectory_file, trajectory_every, trajectory_float32) \
+    if trajectory_file else None
 init_gals()
-# Gravity
-def grav(x1, y1, x2, y2, m1, m2):
-    dx, dy = x2 - x1, y2 - y1
-    dist = math.hypot(dx, dy)
-    if dist == 0:
-        return 0, 0
-    force = G * m1 * m2 / (dist + epsilon) ** 2
-    return force * dx / dist, force * dy / dist
+report_force_error()
+
+# Physics: one force pass over every body of every galaxy, all kicked from
+# the same positions before any of them drifts; runs on the physics thread
+def physics_step():
+    global step_count
+    profiler.call("update", integrator.step,
+                  bodies.positions, bodies.velocities, bodies.masses, G, dt, epsilon)
+    step_count += 1
+    profiler.count_step()
+    if capture_radius > 0:
+        profiler.call("update", handle_encounters)
+    if checkpoint_every > 0 and step_count % checkpoint_every == 0:
+        save_state()
+    if trajectory is not None:
+        trajectory.write(step_count, bodies.positions, bodies.velocities, bodies.masses)
+# Close pairs from the spatial grid: counted, or merged into single bodies
+def handle_encounters():
+    global encounters, merged
+    if not merge_bodies:
+        encounters = len(close_pairs(bodies.positions, capture_radius)[0])
+        return
+    count = merge_encounters(bodies, capture_radius)
+    if count:
+        merged += count
+        integrator.reset()
+def take_snapshot():
+    return bodies.positions.copy(), color_index(bodies.masses, sun_mass)
+# substeps steps per frame on a worker; the loop draws the latest finished
+# snapshot and changes the bodies only while the worker is held
+physics = PhysicsWorker(physics_step, take_snapshot, substeps, threaded=physics_thread)
 
 # Main loop
 run = True
 paused = False
 while run:
-    screen.fill((0, 0, 0))
+    profiler.begin()
+    dirty.begin()
     # Event handling
     for evt in pygame.event.get():
         if evt.type == pygame.QUIT:
@@ -179,134 +327,105 @@ while run:
                 paused = not paused
             elif evt.key == pygame.K_r and paused:
                 paused = False
+            elif evt.key == pygame.K_t:
+                profiler.toggle()
+            elif evt.key == pygame.K_s:
+                with physics.hold():
+                    save_state()
+            elif evt.key == pygame.K_l:
+                with physics.hold():
+                    load_state()
         elif evt.type == pygame.MOUSEBUTTONDOWN:
             mx, my = evt.pos
             # check center grabs
-            if math.hypot(mx-center1_x, my-center1_y) < center_radius:
-                dragging1 = True
-                offset_x = center1_x - mx
-                offset_y = center1_y - my
-            elif math.hypot(mx-center2_x, my-center2_y) < center_radius:
-                dragging2 = True
-                offset_x = center2_x - mx
-                offset_y = center2_y - my
+            grabbed = [k for k, (cx, cy) in enumerate(centers) if math.hypot(mx-cx, my-cy) < center_radius]
+            if grabbed:
+                dragging = grabbed[0]
+                offset_x = centers[dragging][0] - mx
+                offset_y = centers[dragging][1] - my
             else:
                 # UI clicks
                 if pause_rect.collidepoint((mx, my)):
                     paused = not paused
                 elif restart_rect.collidepoint((mx, my)):
-                    init_gals()
+                    with physics.hold():
+                        init_gals()
                     paused = False
                 elif compress_rect.collidepoint((mx, my)):
-                    for l in layers:
-                        l['radius'] *= 0.9
-                    init_gals()
+                    with physics.hold():
+                        for l in layers:
+                            l['radius'] *= 0.9
+                        init_gals()
                 elif spread_rect.collidepoint((mx, my)):
-                    for l in layers:
-                        l['radius'] *= 1.1
-                    init_gals()
+                    with physics.hold():
+                        for l in layers:
+                            l['radius'] *= 1.1
+                        init_gals()
                 elif settings_rect.collidepoint((mx, my)):
-                    G, mass_center, speed_multiplier, dt, epsilon, layer_factor, num_per_layer, inter_dist = show_start_screen()
-                    center1_x = WIDTH//2 - int(inter_dist/2)
-                    center2_x = WIDTH//2 + int(inter_dist/2)
-                    layers[:] = [{"num": num_per_layer, "radius": r*layer_factor, "speed": s*G_factor}
-                                  for r, s in [(10,10.0),(20,8.2),(30,7.1),(40,6.3),(50,5.8),(60,5.2),(70,4.6),(80,4.0),(90,3.5),(100,3.0)]]
-                    for l in layers:
-                        l['speed'] *= speed_multiplier
-                    init_gals()
+                    with physics.hold():
+                        G, mass_center, speed_multiplier, dt, epsilon, layer_factor, num_per_layer, inter_dist = show_start_screen()
+                        for c, (cx, _) in zip(centers, galaxy_centers(num_galaxies, WIDTH//2, HEIGHT//2, inter_dist)):
+                            c[0] = cx
+                        layers[:] = make_layers(num_per_layer, layer_factor, speed_multiplier, G_factor)
+                        init_gals()
+                        report_force_error()
+                    ui_layer.invalidate()
+                    dirty.invalidate()
                     paused = False
                 else:
                     for i in range(len(layers)):
                         if add_btns[i].collidepoint((mx, my)):
-                            layers[i]['num'] += 1
-                            init_gals()
+                            with physics.hold():
+                                change_layer(i, 1)
                             break
                         if rem_btns[i].collidepoint((mx, my)) and layers[i]['num'] > 0:
-                            layers[i]['num'] -= 1
-                            init_gals()
+                            with physics.hold():
+                                change_layer(i, -1)
                             break
         elif evt.type == pygame.MOUSEBUTTONUP:
-            dragging1 = dragging2 = False
+            dragging = None
         elif evt.type == pygame.MOUSEMOTION:
-            if 'dragging1' in locals() and dragging1:
-                center1_x = evt.pos[0] + offset_x
-                center1_y = evt.pos[1] + offset_y
-            if 'dragging2' in locals() and dragging2:
-                center2_x = evt.pos[0] + offset_x
-                center2_y = evt.pos[1] + offset_y
+            if dragging is not None:
+                centers[dragging][0] = evt.pos[0] + offset_x
+                centers[dragging][1] = evt.pos[1] + offset_y
 
-    # Physics update
+    profiler.lap("events")
+
+    # Physics update: the next substeps steps, on the physics thread
     if not paused:
-        # Galaxy 1
-        new_pos1 = []
-        for i in range(len(pos1)):
-            fx = fy = 0
-            for j in range(len(pos1)):
-                if i != j:
-                    dfx, dfy = grav(pos1[i][0], pos1[i][1], pos1[j][0], pos1[j][1], m1s[i], m1s[j])
-                    fx += dfx
-                    fy += dfy
-            for j in range(len(pos2)):
-                dfx, dfy = grav(pos1[i][0], pos1[i][1], pos2[j][0], pos2[j][1], m1s[i], m2s[j])
-                fx += dfx
-                fy += dfy
-            vx, vy = vel1[i]
-            vx += fx / m1s[i] * dt
-            vy += fy / m1s[i] * dt
-            x, y = pos1[i]
-            x += vx * dt
-            y += vy * dt
-            vel1[i] = (vx, vy)
-            new_pos1.append((x, y))
-        pos1 = new_pos1
-        # Galaxy 2
-        new_pos2 = []
-        for i in range(len(pos2)):
-            fx = fy = 0
-            for j in range(len(pos2)):
-                if i != j:
-                    dfx, dfy = grav(pos2[i][0], pos2[i][1], pos2[j][0], pos2[j][1], m2s[i], m2s[j])
-                    fx += dfx
-                    fy += dfy
-            for j in range(len(pos1)):
-                dfx, dfy = grav(pos2[i][0], pos2[i][1], pos1[j][0], pos1[j][1], m2s[i], m1s[j])
-                fx += dfx
-                fy += dfy
-            vx, vy = vel2[i]
-            vx += fx / m2s[i] * dt
-            vy += fy / m2s[i] * dt
-            x, y = pos2[i]
-            x += vx * dt
-            y += vy * dt
-            vel2[i] = (vx, vy)
-            new_pos2.append((x, y))
-        pos2 = new_pos2
+        physics.request()
+
+    # Drawing bodies of the latest snapshot: colour from mass, all bodies in one batched write
+    _, shown, shown_colors = physics.latest()
+    if interpolate:
+        shown = physics.interpolate()
+    dirty.add(body_painter.draw(shown, shown_colors))
+
+    # Draw galaxy centers (draggable)
+    for k, (cx, cy) in enumerate(centers):
+        dirty.add(pygame.draw.circle(screen, center_colors[k % len(center_colors)], (int(cx), int(cy)), center_radius))
 
-    # Drawing bodies
-    for p, m in zip(pos1, m1s):
-        idx = int(m / sun_mass) - 1
-        idx = max(0, min(idx, len(colors)-1))
-        c = colors[idx]
-        pygame.draw.circle(screen, c, (int(p[0]), int(p[1])), 5)
-    for p, m in zip(pos2, m2s):
-        idx = int(m / sun_mass) - 1
-        idx = max(0, min(idx, len(colors)-1))
-        c = colors[idx]
-        pygame.draw.circle(screen, c, (int(p[0]), int(p[1])), 5)
+    # UI draw (cached layer, opaque, never needs erasing)
+    ui_layer.blit(screen)
 
-        # Draw galaxy centers (draggable)
-    pygame.draw.circle(screen, (255, 255, 255), (int(center1_x), int(center1_y)), center_radius)
-    pygame.draw.circle(screen, (255, 255,   0), (int(center2_x), int(center2_y)), center_radius)
+    # Encounter counters, set by the physics thread (at most a batch ahead)
+    if capture_radius > 0:
+        label = f"Merged: {merged}" if merge_bodies else f"Close encounters: {encounters}"
+        dirty.add(screen.blit(hud_text.render(f"Bodies: {len(shown)} | {label}"), (20, 15)))
 
-    # UI draw
-    draw_button(pause_rect, "Pause", (255, 0, 0))
-    draw_button(restart_rect, "Restart", (0, 255, 0))
-    draw_button(compress_rect, "Compress", (0, 0, 255))
-    draw_button(spread_rect, "Spread", (255, 255, 0))
-    draw_layer_btns()
-    draw_button(settings_rect, "Settings", (254, 0, 255))
+    # Phase timings of the last frames
+    if profiler.enabled:
+        for k, line in enumerate(profiler.summary()):
+            dirty.add(screen.blit(hud_text.render(line), (WIDTH - 330, 10 + 20 * k)))
 
-    pygame.display.flip()
+    dirty.end()
+    profiler.lap("draw")
+    profiler.end_frame(len(shown))
     clock.tick(60)
 
+physics.stop()
+profiler.close()
+save_state()
+if trajectory is not None:
+    trajectory.close()
 pygame.quit()
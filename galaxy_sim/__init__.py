@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+"""
+Shared physics and tooling for the Galaxy Simulation scripts.
+"""
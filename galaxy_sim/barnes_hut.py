@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Barnes-Hut quadtree gravity solver.
+
+The tree is rebuilt from scratch every step: bodies are sorted along a
+Morton (Z-order) curve so that every quadtree node is a contiguous slice of
+the sorted arrays, and each node carries its total mass and centre of mass
+(monopole). Forces are then evaluated for blocks of bodies by walking the
+tree breadth-first with NumPy, opening a node whenever
+
+    node_size >= theta * distance_to_centre_of_mass
+
+Accepted nodes use the same softened law as the direct kernel,
+G * m / (r + Epsilon)**2, so theta -> 0 reproduces direct summation.
+"""
+
+import argparse
+import functools
+import time
+
+import numpy as np
+
+from galaxy_sim.gravity import direct_accelerations, example_disk, force_error
+
+MAX_DEPTH = 21            # 2 * 21 bits of Morton code fit in a uint64
+BODY_BLOCK = 2048         # bodies walked together through the tree
+
+
+def _spread_bits(v):
+    # Insert a zero bit between each of the low 32 bits of v
+    v = v & np.uint64(0xFFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8)))  & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4)))  & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2)))  & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1)))  & np.uint64(0x5555555555555555)
+    return v
+
+
+class QuadTree:
+    """Flattened quadtree over a set of bodies, nodes stored level by level."""
+
+    def __init__(self, positions, masses, max_depth=MAX_DEPTH):
+        positions = np.asarray(positions, dtype=float)
+        masses = np.asarray(masses, dtype=float)
+        n = len(positions)
+
+        lo = positions.min(axis=0)
+        size = float((positions.max(axis=0) - lo).max()) * (1 + 1e-9) or 1.0
+        cells = 1 << max_depth
+        grid = np.clip(((positions - lo) / size * cells).astype(np.int64), 0, cells - 1)
+        codes = (_spread_bits(grid[:, 0].astype(np.uint64))
+                 | (_spread_bits(grid[:, 1].astype(np.uint64)) << np.uint64(1)))
+
+        self.order = np.argsort(codes, kind="stable")
+        codes = codes[self.order]
+        self.x = positions[self.order, 0].copy()
+        self.y = positions[self.order, 1].copy()
+        self.m = masses[self.order].copy()
+
+        # Prefix sums give any node's mass and first moments in O(1)
+        cm = np.concatenate(([0.0], np.cumsum(self.m)))
+        cmx = np.concatenate(([0.0], np.cumsum(self.m * self.x)))
+        cmy = np.concatenate(([0.0], np.cumsum(self.m * self.y)))
+
+        starts, ends, sizes, leaves = [], [], [], []
+        first_child, n_children = [], []
+        level_starts = np.array([0])
+        level_ends = np.array([n])
+        offset = 0
+        for level in range(max_depth + 1):
+            count = level_ends - level_starts
+            leaf = (count == 1) | (level == max_depth)
+            starts.append(level_starts)
+            ends.append(level_ends)
+            sizes.append(np.full(len(level_starts), size / (1 << level)))
+            leaves.append(leaf)
+            offset += len(level_starts)
+
+            if leaf.all():
+                first_child.append(np.zeros(len(level_starts), dtype=np.int64))
+                n_children.append(np.zeros(len(level_starts), dtype=np.int64))
+                break
+
+            # Children: split every internal node where the next two code bits change
+            shift = np.uint64(2 * (max_depth - level - 1))
+            key = codes >> shift
+            cuts = np.flatnonzero(key[1:] != key[:-1]) + 1
+            child_starts = np.union1d(cuts, level_starts)
+            parent = np.searchsorted(level_starts, child_starts, side="right") - 1
+            keep = parent >= 0
+            keep[keep] = (~leaf[parent[keep]]) & (child_starts[keep] < level_ends[parent[keep]])
+            child_starts = child_starts[keep]
+            parent = parent[keep]
+            child_ends = np.append(child_starts[1:], n)
+            child_ends = np.minimum(child_ends, level_ends[parent])
+
+            counts = np.bincount(parent, minlength=len(level_starts))
+            first = np.concatenate(([0], np.cumsum(counts)[:-1])) + offset
+            first_child.append(np.where(counts > 0, first, 0))
+            n_children.append(counts)
+
+            level_starts, level_ends = child_starts, child_ends
+
+        self.start = np.concatenate(starts)
+        self.end = np.concatenate(ends)
+        self.size = np.concatenate(sizes)
+        self.leaf = np.concatenate(leaves)
+        self.first_child = np.concatenate(first_child)
+        self.n_children = np.concatenate(n_children)
+        self.mass = cm[self.end] - cm[self.start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.com_x = (cmx[self.end] - cmx[self.start]) / self.mass
+            self.com_y = (cmy[self.end] - cmy[self.start]) / self.mass
+        # Single-body (and massless) nodes take the exact body values, so a
+        # body meets its own leaf at r == 0 rather than at a round-off distance
+        single = (self.end - self.start == 1) | ~(self.mass > 0)
+        self.mass[single] = np.where(self.end[single] - self.start[single] == 1,
+                                     self.m[self.start[single]], 0.0)
+        self.com_x[single] = self.x[self.start[single]]
+        self.com_y[single] = self.y[self.start[single]]
+
+    def accelerations(self, G, epsilon, theta, potential=False, targets=None):
+        """Return accelerations in the original (unsorted) body order.
+
+        With ``potential=True`` returns ``(acc, energy)``, the potential energy
+        being accumulated from the same node interactions as the forces.
+        With ``targets`` (original indices) only those bodies walk the tree
+        and their accelerations are returned in the order given.
+        """
+        n = len(self.x)
+        if targets is None:
+            walkers = np.arange(n)
+        else:
+            rank = np.empty(n, dtype=np.int64)
+            rank[self.order] = np.arange(n)
+            walkers = rank[np.asarray(targets)]
+        acc_sorted = np.zeros((len(walkers), 2))
+        phi = np.zeros(len(walkers))
+        for block_start in range(0, len(walkers), BODY_BLOCK):
+            block = slice(block_start, block_start + BODY_BLOCK)
+            acc_sorted[block] = self._walk(walkers[block], G, epsilon, theta,
+                                           phi[block] if potential else None)
+        if targets is None:
+            acc = np.empty_like(acc_sorted)
+            acc[self.order] = acc_sorted
+        else:
+            acc = acc_sorted
+        if potential:
+            return acc, 0.5 * float(self.m[walkers] @ phi)
+        return acc
+
+    def _walk(self, walkers, G, epsilon, theta, phi=None):
+        # ``walkers`` are sorted body indices; ``body`` below indexes into them
+        count = len(walkers)
+        ax = np.zeros(count)
+        ay = np.zeros(count)
+
+        body = np.arange(count)
+        node = np.zeros(count, dtype=np.int64)
+        while len(body):
+            dx = self.com_x[node] - self.x[walkers[body]]
+            dy = self.com_y[node] - self.y[walkers[body]]
+            r = np.hypot(dx, dy)
+            leaf = self.leaf[node]
+            accept = leaf | (self.size[node] < theta * r)
+
+            # Leaves holding several bodies (max depth reached) are summed directly
+            multi = accept & leaf & (self.end[node] - self.start[node] > 1)
+            if multi.any():
+                self._direct_leaves(walkers, body[multi], node[multi],
+                                    G, epsilon, ax, ay, phi)
+                accept &= ~multi
+
+            f = (r[accept] + epsilon) ** 2 * r[accept]
+            np.divide(G * self.mass[node[accept]], f, out=f, where=f != 0)
+            target = body[accept]
+            ax += np.bincount(target, weights=f * dx[accept], minlength=count)
+            ay += np.bincount(target, weights=f * dy[accept], minlength=count)
+            if phi is not None:
+                f *= (r[accept] + epsilon) * r[accept]
+                phi -= np.bincount(target, weights=f, minlength=count)
+
+            opened = ~(accept | multi)
+            body, node = _expand(body[opened], self.first_child[node[opened]],
+                                 self.n_children[node[opened]])
+        return np.column_stack((ax, ay))
+
+    def _direct_leaves(self, walkers, body, node, G, epsilon, ax, ay, phi):
+        body, other = _expand(body, self.start[node], self.end[node] - self.start[node])
+        dx = self.x[other] - self.x[walkers[body]]
+        dy = self.y[other] - self.y[walkers[body]]
+        r = np.hypot(dx, dy)
+        f = (r + epsilon) ** 2 * r
+        np.divide(G * self.m[other], f, out=f, where=f != 0)
+        ax += np.bincount(body, weights=f * dx, minlength=len(ax))
+        ay += np.bincount(body, weights=f * dy, minlength=len(ay))
+        if phi is not None:
+            f *= (r + epsilon) * r
+            phi -= np.bincount(body, weights=f, minlength=len(ax))
+
+
+def _expand(body, first, counts):
+    # Pair each body with the consecutive range first .. first + counts - 1
+    total = int(counts.sum())
+    body = np.repeat(body, counts)
+    run_starts = np.cumsum(counts) - counts
+    offsets = np.arange(total) - np.repeat(run_starts, counts)
+    return body, np.repeat(first, counts) + offsets
+
+
+def barnes_hut_accelerations(positions, masses, G, epsilon, theta=0.5, potential=False,
+                             targets=None):
+    """Return the (N, 2) accelerations using a freshly built quadtree.
+
+    With ``potential=True`` returns ``(acc, potential_energy)``. With
+    ``targets`` only those bodies' accelerations are evaluated.
+    """
+    if len(positions) == 0:
+        return (np.zeros((0, 2)), 0.0) if potential else np.zeros((0, 2))
+    return QuadTree(positions, masses).accelerations(G, epsilon, theta, potential, targets)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report Barnes-Hut force error and timing against direct summation.")
+    parser.add_argument("--bodies", type=int, default=5000)
+    parser.add_argument("--thetas", type=float, nargs="+", default=[0.3, 0.5, 0.7, 1.0])
+    parser.add_argument("--epsilon", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    positions, masses = example_disk(args.bodies, args.seed)
+
+    t0 = time.perf_counter()
+    direct_accelerations(positions, masses, 1.0, args.epsilon)
+    print(f"direct      : {time.perf_counter() - t0:8.3f} s")
+    for theta in args.thetas:
+        t0 = time.perf_counter()
+        barnes_hut_accelerations(positions, masses, 1.0, args.epsilon, theta)
+        elapsed = time.perf_counter() - t0
+        engine = functools.partial(barnes_hut_accelerations, theta=theta)
+        median, p99, worst = force_error(engine, positions, masses, 1.0, args.epsilon)
+        print(f"theta = {theta:4.2f}: {elapsed:8.3f} s | relative error "
+              f"median {median:.2e}, p99 {p99:.2e}, max {worst:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite: speed, memory and conservation of the physics loop.
+
+    python -m galaxy_sim.benchmark --output bench.json
+    python -m galaxy_sim.benchmark --baseline bench.json
+
+Runs the single-galaxy disk and the two-galaxy scene of the scripts, with
+their start-screen defaults, at a ladder of body counts for every force
+engine, integrator and precision mode, and records per case:
+
+    steps_per_sec    from the median step time (the first, warm-up step is
+                     not timed), so one slow step does not count as a trend
+    peak_mb          largest memory held by the allocations of one step
+                     (NumPy arrays and Python objects, via tracemalloc);
+                     None for the parallel engine, whose work is allocated
+                     in worker processes tracemalloc does not see
+    energy_drift     relative change of the total energy over the run
+    momentum_drift   relative change of the angular momentum over the run
+
+Every case runs the same ``--steps``, so drifts compare between runs, and the
+drifts are measured in double precision whatever the storage: a float32 or
+mixed case records its ``energy_drift_penalty``, the difference from the
+float64 case's energy drift: the price of its smaller memory footprint. Only the direct engine
+computes in single precision, so the other engines run in float64 only. A case
+whose warm-up step shows it would take longer than ``--budget`` seconds is
+skipped, together with the larger counts of the same engine and integrator.
+
+With ``--baseline`` the results are compared against an earlier output file:
+slower steps, more memory or a larger drift than the tolerances allow are
+listed as regressions and the exit status is 1.
+"""
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+
+from galaxy_sim.engines import ENGINES, PRECISIONS, make_engine, storage_dtype
+from galaxy_sim.headless import SETTINGS, conserved_quantities
+from galaxy_sim.integrators import INTEGRATORS, make_integrator
+from galaxy_sim.scene import disk, galaxies, galaxy_centers, make_layers
+
+SCENES = ("disk", "two-galaxies")
+COUNTS = (200, 1000, 5000, 20000, 100000)
+
+# Regression thresholds for --baseline
+SPEED_TOLERANCE = 0.25     # steps/s may drop by this fraction (timing noise)
+MEMORY_TOLERANCE = 0.2     # peak memory may grow by this fraction
+DRIFT_FACTOR = 2.0         # |drift| may grow by this factor ...
+DRIFT_FLOOR = 1e-6         # ... once it is above this level
+
+
+def build_scene(scene, bodies, settings=SETTINGS):
+    """Initial (positions, velocities, masses) of ``scene`` with about ``bodies`` bodies.
+
+    ``disk`` is the single galaxy of "Galaxy Simulation.py", ``two-galaxies``
+    the scene of "Two Galaxies Simulation.py"; the bodies per layer are
+    chosen to come closest to the requested total.
+    """
+    count = 1 if scene == "disk" else settings["galaxies"]
+    layers = make_layers(1, settings["layer_factor"], settings["speed_mult"])
+    per_layer = max(1, round((bodies - count) / (len(layers) * count)))
+    for layer in layers:
+        layer["num"] = per_layer
+    cx, cy = settings["center"]
+    if scene == "disk":
+        return disk(layers, cx, cy, settings["center_mass"])
+    centers = galaxy_centers(count, cx, cy, settings["intergalactic_dist"])
+    return galaxies(layers, centers, settings["center_mass"])[:3]
+
+
+def run_case(scene, bodies, engine_name, integrator_name, steps, budget, settings=SETTINGS,
+             precision="float64"):
+    """Run one benchmark case; returns its result dict (``skipped`` if over budget)."""
+    positions, velocities, masses = (a.astype(storage_dtype(precision))
+                                     for a in build_scene(scene, bodies, settings))
+    engine = make_engine(engine_name, precision=precision)
+    try:
+        return _measure(engine, make_integrator(integrator_name, engine), positions,
+                        velocities, masses, steps, budget, settings,
+                        {"scene": scene, "bodies": len(masses), "engine": engine_name,
+                         "integrator": integrator_name, "precision": precision,
+                         "steps": steps})
+    finally:
+        if hasattr(engine, "close"):
+            engine.close()              # the parallel engine's worker processes
+
+
+def _measure(engine, integrator, positions, velocities, masses, steps, budget, settings,
+             result):
+    G, dt, epsilon = settings["G"], settings["dt"], settings["epsilon"]
+    initial = conserved_quantities(positions, velocities, masses, G, epsilon,
+                                   settings["center"], engine)
+
+    # Warm-up step, traced for the memory peak
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    integrator.step(positions, velocities, masses, G, dt, epsilon)
+    first = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    if getattr(engine, "pool", None) is not None:
+        peak = None                     # only the parent's share; the workers are not traced
+    if first * steps > budget:
+        result.update(skipped=True, seconds_per_step=first)
+        return result
+
+    times = np.empty(steps - 1)
+    for k in range(steps - 1):
+        t0 = time.perf_counter()
+        integrator.step(positions, velocities, masses, G, dt, epsilon)
+        times[k] = time.perf_counter() - t0
+    median = float(np.median(times))
+    final = conserved_quantities(positions, velocities, masses, G, epsilon,
+                                 settings["center"], engine)
+
+    def drift(key):
+        return (final[key] - initial[key]) / abs(initial[key]) if initial[key] else 0.0
+
+    result.update(skipped=False,
+                  steps_per_sec=1 / median if median > 0 else float("inf"),
+                  peak_mb=None if peak is None else peak / 2**20,
+                  energy_drift=drift("total_energy"),
+                  momentum_drift=drift("angular_momentum"),
+                  force_evaluations=integrator.evaluations)
+    return result
+
+
+def case_key(result):
+    # Results written before the precision modes were all float64
+    return (result["scene"], result["bodies"], result["engine"], result["integrator"],
+            result.get("precision", "float64"))
+
+
+def compare(results, baseline, speed_tolerance=SPEED_TOLERANCE):
+    """Regressions of ``results`` against the results of ``baseline`` as messages."""
+    previous = {case_key(r): r for r in baseline["results"] if not r["skipped"]}
+    problems = []
+    for r in results:
+        old = previous.get(case_key(r))
+        if old is None or r["skipped"]:
+            continue
+        name = "{} {} bodies, {}/{} {}".format(*case_key(r))
+        if r["steps_per_sec"] < old["steps_per_sec"] * (1 - speed_tolerance):
+            problems.append(f"{name}: {r['steps_per_sec']:.3g} steps/s, "
+                            f"was {old['steps_per_sec']:.3g}")
+        if (r["peak_mb"] is not None and old["peak_mb"] is not None
+                and r["peak_mb"] > old["peak_mb"] * (1 + MEMORY_TOLERANCE) + 0.1):
+            problems.append(f"{name}: peak {r['peak_mb']:.1f} MB, was {old['peak_mb']:.1f} MB")
+        if r["steps"] != old["steps"]:
+            continue                     # drifts over different run lengths do not compare
+        for key in ("energy_drift", "momentum_drift"):
+            limit = max(abs(old[key]) * DRIFT_FACTOR, DRIFT_FLOOR)
+            if abs(r[key]) > limit:
+                problems.append(f"{name}: {key} {r[key]:+.2e}, was {old[key]:+.2e}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark steps/s, memory and conservation across engines and integrators.")
+    parser.add_argument("--scenes", nargs="+", choices=SCENES, default=list(SCENES))
+    parser.add_argument("--counts", type=int, nargs="+", default=list(COUNTS),
+                        help="body counts of the ladder")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--integrators", nargs="+", choices=INTEGRATORS,
+                        default=list(INTEGRATORS))
+    parser.add_argument("--precisions", nargs="+", choices=PRECISIONS, default=list(PRECISIONS),
+                        help="precision modes (float32 and mixed run with the direct engine)")
+    parser.add_argument("--steps", type=int, default=20, help="steps per case")
+    parser.add_argument("--budget", type=float, default=60,
+                        help="seconds a case may take before it is skipped")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", help="earlier results to check for regressions")
+    parser.add_argument("--speed-tolerance", type=float, default=SPEED_TOLERANCE,
+                        help="fraction of steps/s a case may lose before it counts as a regression")
+    args = parser.parse_args()
+    steps = max(2, args.steps)
+
+    results = []
+    for engine_name in args.engines:
+        precisions = [p for p in PRECISIONS if p in args.precisions
+                      and (p == "float64" or engine_name == "direct")]
+        for integrator_name in args.integrators:
+            # Compile and start up the engine outside the measurements
+            for precision in precisions:
+                run_case("disk", 50, engine_name, integrator_name, 2, float("inf"),
+                         precision=precision)
+            for scene in args.scenes:
+                too_slow = set()
+                for bodies in sorted(args.counts):
+                    reference = None
+                    for precision in precisions:
+                        if precision in too_slow:
+                            continue
+                        r = run_case(scene, bodies, engine_name, integrator_name, steps,
+                                     args.budget, precision=precision)
+                        results.append(r)
+                        label = (f"{scene:>12} {r['bodies']:>7} {engine_name:>13} "
+                                 f"{integrator_name:>8} {precision:>7}")
+                        if r["skipped"]:
+                            too_slow.add(precision)
+                            print(f"{label}  skipped (~{r['seconds_per_step'] * steps:.0f} s)",
+                                  flush=True)
+                            continue
+                        penalty = ""
+                        if precision == "float64":
+                            reference = r
+                        elif reference is not None:
+                            r["energy_drift_penalty"] = (r["energy_drift"]
+                                                         - reference["energy_drift"])
+                            penalty = f"  penalty {r['energy_drift_penalty']:+.1e}"
+                        memory = "     n/a" if r["peak_mb"] is None else f"{r['peak_mb']:8.1f}"
+                        print(f"{label}  {r['steps_per_sec']:10.2f} steps/s "
+                              f"{memory} MB  energy {r['energy_drift']:+.2e}  "
+                              f"L {r['momentum_drift']:+.2e}{penalty}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(),
+                       "numpy": np.__version__, "steps": steps, "results": results},
+                      f, indent=1)
+        print(f"Results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.speed_tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        print(f"{len(problems)} regressions against {args.baseline}")
+        if problems:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+Conservation diagnostics on body arrays.
+
+The potential energy comes from the force engines (``potential=True``), in
+the same pass as the accelerations.
+"""
+
+import numpy as np
+
+
+def kinetic_energy(velocities, masses):
+    return 0.5 * float(np.sum(masses * np.einsum("ij,ij->i", velocities, velocities)))
+
+
+def angular_momentum(positions, velocities, masses, cx, cy):
+    rx = positions[:, 0] - cx
+    ry = positions[:, 1] - cy
+    return float(np.sum(masses * (rx * velocities[:, 1] - ry * velocities[:, 0])))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Batched drawing of the bodies onto a pygame surface.
+
+Instead of one ``pygame.draw.circle`` call per body, all positions are
+converted to pixel coordinates at once, bodies off the surface are culled,
+and a pre-rendered disc is stamped for every body straight into the
+surface's pixels through a ``surfarray`` view. The disc is taken from
+``pygame.draw.circle`` itself, so the picture is the same as before. Later
+bodies cover earlier ones, as successive draw calls would; the few discs
+crossing the border are clipped and drawn last.
+
+The stamping loop is compiled when Numba is installed (10**5 discs of
+radius 5 in a few milliseconds); otherwise it is a single NumPy scatter.
+"""
+
+import numpy as np
+import pygame
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _stamp(flat, centres, offsets, values):
+    for i in range(len(centres)):
+        c = centres[i]
+        v = values[i]
+        for o in offsets:
+            flat[c + o] = v
+
+
+if numba is not None:
+    _stamp = numba.njit(cache=True)(_stamp)
+else:
+    def _stamp(flat, centres, offsets, values):
+        flat[centres[:, np.newaxis] + offsets] = values[:, np.newaxis]
+
+
+def circle_offsets(radius):
+    """Pixel offsets (dx, dy) that ``pygame.draw.circle`` fills for ``radius``."""
+    size = 2 * int(np.ceil(radius)) + 3
+    sprite = pygame.Surface((size, size))
+    pygame.draw.circle(sprite, (255, 255, 255), (size // 2, size // 2), radius)
+    dx, dy = np.nonzero(pygame.surfarray.array2d(sprite))
+    return dx - size // 2, dy - size // 2
+
+
+class BodyPainter:
+    """Draws discs in palette colours for a whole body array per call."""
+
+    def __init__(self, surface, palette, radius=5):
+        self.surface = surface
+        self.radius = radius
+        self.dx, self.dy = circle_offsets(radius)
+        self.reach = int(max(np.abs(self.dx).max(), np.abs(self.dy).max()))
+        # Palette colours in the surface's own pixel format
+        self.mapped = np.array([surface.map_rgb(c) for c in palette], dtype=np.int64)
+
+    def draw(self, positions, color_index):
+        """Draw every body at ``positions`` in palette colour ``color_index``.
+
+        Returns the rectangle of the surface that was drawn on.
+        """
+        width, height = self.surface.get_size()
+        r = self.reach
+        # int() truncation, like the per-body draw calls
+        px = positions[:, 0].astype(np.int64)
+        py = positions[:, 1].astype(np.int64)
+        visible = (px >= -r) & (px < width + r) & (py >= -r) & (py < height + r)
+        px, py = px[visible], py[visible]
+        if len(px) == 0:
+            return pygame.Rect(0, 0, 0, 0)
+        edge = (px < r) | (px >= width - r) | (py < r) | (py >= height - r)
+
+        pixels = flat = pygame.surfarray.pixels2d(self.surface)
+        try:
+            values = self.mapped[np.asarray(color_index)[visible]].astype(pixels.dtype)
+            # Rows are ``pitch`` pixels apart; index the pixels as one flat array
+            pitch = pixels.strides[1] // pixels.itemsize
+            flat = np.lib.stride_tricks.as_strided(
+                pixels, shape=(pitch * (height - 1) + width,), strides=(pixels.itemsize,))
+            inner = ~edge
+            _stamp(flat, py[inner] * pitch + px[inner], self.dy * pitch + self.dx, values[inner])
+            if edge.any():
+                xs = px[edge, np.newaxis] + self.dx
+                ys = py[edge, np.newaxis] + self.dy
+                inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+                pixels[xs[inside], ys[inside]] = np.broadcast_to(
+                    values[edge, np.newaxis], xs.shape)[inside]
+        finally:
+            del pixels, flat                 # unlock the surface
+        x0, y0 = int(px.min()) - r, int(py.min()) - r
+        bounds = pygame.Rect(x0, y0, int(px.max()) + r + 1 - x0, int(py.max()) + r + 1 - y0)
+        return bounds.clip(self.surface.get_rect())
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Selection of the force engine used by the simulation scripts.
+
+Every engine is a callable ``engine(positions, masses, G, epsilon)`` that
+returns the (N, 2) array of accelerations. Called with ``potential=True`` it
+returns ``(accelerations, potential_energy)`` from the same pass, and with
+``targets=`` (an index array) it returns only those bodies' accelerations,
+still summing over every body.
+
+Precision modes set how the bodies are stored and summed:
+
+    float64   double-precision storage and arithmetic (the default)
+    float32   single-precision storage, pair terms and sums: half the memory
+              and bandwidth of float64
+    mixed     single-precision storage and pair terms, double-precision sums
+              of the forces and the potential energy
+
+Only the direct engine computes in single precision; the other engines take
+float32 bodies but work in float64 internally.
+"""
+
+import functools
+import os
+
+import numpy as np
+
+from galaxy_sim.barnes_hut import barnes_hut_accelerations
+from galaxy_sim.gravity import symmetric_accelerations
+from galaxy_sim.jit_kernels import AVAILABLE as JIT_AVAILABLE, jit_accelerations
+from galaxy_sim.parallel import ParallelEngine
+from galaxy_sim.particle_mesh import GRID, pm_accelerations
+
+ENGINES = ("direct", "barnes-hut", "parallel", "particle-mesh")
+PRECISIONS = ("float64", "float32", "mixed")
+
+
+def storage_dtype(precision):
+    """dtype of the body arrays in the precision mode ``precision``."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"unknown precision {precision!r}, expected one of "
+                         f"{', '.join(PRECISIONS)}")
+    return np.float64 if precision == "float64" else np.float32
+
+
+def make_engine(name, theta=0.5, workers=0, grid=GRID, precision="float64"):
+    """Return the force engine called ``name`` configured with its options.
+
+    ``theta`` is the Barnes-Hut opening angle, ``workers`` the number of
+    processes of the parallel engine (0 = one per CPU core) and ``grid`` the
+    cells per side of the particle mesh. ``precision`` is one of
+    ``PRECISIONS``; the bodies must be stored in ``storage_dtype(precision)``.
+    """
+    storage_dtype(precision)
+    if name == "direct":
+        # Exact summation, each pair evaluated once: compiled when Numba is
+        # installed, otherwise in cache-sized NumPy tiles. The kernels follow
+        # the storage precision; mixed only asks for double-precision sums
+        kernel = jit_accelerations if JIT_AVAILABLE else symmetric_accelerations
+        if precision == "mixed":
+            return functools.partial(kernel, accumulate=np.float64)
+        return kernel
+    if name == "barnes-hut":
+        return functools.partial(barnes_hut_accelerations, theta=theta)
+    if name == "parallel":
+        return ParallelEngine(workers or os.cpu_count())
+    if name == "particle-mesh":
+        return functools.partial(pm_accelerations, grid=grid)
+    raise ValueError(f"unknown force engine {name!r}, expected one of {', '.join(ENGINES)}")
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch mode for the simulation scripts.
+
+Runs a fixed number of steps as fast as the CPU allows: no window, no event
+pump and no frame cap. The settings normally typed into the start screen are
+taken from the command line, e.g.
+
+    python "Galaxy Simulation.py" --headless --steps 5000 --bodies-per-layer 200
+    python "Two Galaxies Simulation.py" --headless --steps 2000 --intergalactic-dist 400 --galaxies 3
+
+On exit (including Ctrl-C) the final state and conservation diagnostics are
+written to an .npz file and summarised on stdout. With ``--checkpoint`` the
+full state is also saved as a binary checkpoint every ``--checkpoint-every``
+steps and on exit; ``--resume`` continues from such a checkpoint.
+``--capture-radius`` counts close encounters every step, and with ``--merge``
+merges them into single bodies (see ``galaxy_sim.encounters``).
+``--trajectory`` records the bodies every ``--trajectory-every`` steps to a
+trajectory file (see ``galaxy_sim.trajectory``).
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from galaxy_sim.checkpoint import load_checkpoint, save_checkpoint
+from galaxy_sim.diagnostics import angular_momentum, kinetic_energy
+from galaxy_sim.encounters import close_pairs, merge_encounters
+from galaxy_sim.engines import ENGINES, PRECISIONS, make_engine, storage_dtype
+from galaxy_sim.integrators import INTEGRATORS, make_integrator
+from galaxy_sim.particles import Particles
+from galaxy_sim.scene import PROFILES, build_disk, galaxies, galaxy_centers, make_layers
+from galaxy_sim.trajectory import TrajectoryWriter
+
+# Start-screen defaults of the scripts, shared by the batch tools
+SETTINGS = {"G": 1.0, "center_mass": 10000.0, "speed_mult": 1.0, "dt": 0.5, "epsilon": 50.0,
+            "layer_factor": 3.0, "bodies_per_layer": 20, "intergalactic_dist": 200.0,
+            "galaxies": 2, "center": (750, 500)}
+# Disk options that are not on the start screen
+DISK_OPTIONS = {"profile": "rings", "scale": 100.0, "equilibrium": False, "seed": 0}
+
+
+def parse_args(argv, defaults, two_galaxies=False):
+    """Parse the headless command line; ``defaults`` come from the calling script."""
+    parser = argparse.ArgumentParser(description="Run the simulation without a display.")
+    parser.add_argument("--headless", action="store_true", help="run without a display")
+    parser.add_argument("--steps", type=int, default=1000, help="number of steps to run")
+    parser.add_argument("--output", default=defaults["output"],
+                        help="file for the final state and diagnostics (.npz)")
+    parser.add_argument("--G", type=float, default=defaults["G"])
+    parser.add_argument("--center-mass", type=float, default=defaults["center_mass"])
+    parser.add_argument("--speed-mult", type=float, default=defaults["speed_mult"])
+    parser.add_argument("--dt", type=float, default=defaults["dt"])
+    parser.add_argument("--epsilon", type=float, default=defaults["epsilon"])
+    parser.add_argument("--layer-factor", type=float, default=defaults["layer_factor"])
+    parser.add_argument("--bodies-per-layer", type=int, default=defaults["bodies_per_layer"])
+    if two_galaxies:
+        parser.add_argument("--intergalactic-dist", type=float,
+                            default=defaults["intergalactic_dist"])
+        parser.add_argument("--galaxies", type=int, default=defaults["galaxies"],
+                            help="number of galaxies in the scene")
+    parser.add_argument("--profile", choices=PROFILES, default=DISK_OPTIONS["profile"],
+                        help="radial distribution of the bodies (default: the layer rings)")
+    parser.add_argument("--scale", type=float, default=DISK_OPTIONS["scale"],
+                        help="radial scale of the exponential and Plummer profiles")
+    parser.add_argument("--equilibrium", action="store_true",
+                        help="rings: circular speeds from the enclosed mass instead of "
+                             "the layer table")
+    parser.add_argument("--seed", type=int, default=DISK_OPTIONS["seed"], help="random seed of the profiles")
+    parser.add_argument("--engine", choices=ENGINES, default=defaults["engine"])
+    parser.add_argument("--theta", type=float, default=defaults["theta"],
+                        help="Barnes-Hut opening angle")
+    parser.add_argument("--workers", type=int, default=defaults["workers"],
+                        help="processes for the parallel engine (0 = one per core)")
+    parser.add_argument("--grid", type=int, default=defaults["grid"],
+                        help="particle-mesh cells per side")
+    parser.add_argument("--integrator", choices=INTEGRATORS, default=defaults["integrator"])
+    parser.add_argument("--precision", choices=PRECISIONS,
+                        default=defaults.get("precision", "float64"),
+                        help="body storage and force summation precision")
+    parser.add_argument("--capture-radius", type=float,
+                        default=defaults.get("capture_radius", 0),
+                        help="distance below which two bodies are a close encounter "
+                             "(0 = not checked)")
+    parser.add_argument("--merge", action="store_true", default=defaults.get("merge", False),
+                        help="merge close encounters into one body (mass and momentum "
+                             "conserved, energy not)")
+    parser.add_argument("--checkpoint", help="binary checkpoint file written during the run")
+    parser.add_argument("--checkpoint-every", type=int, default=0,
+                        help="steps between checkpoints (0 = only on exit)")
+    parser.add_argument("--resume", help="checkpoint to continue from; its bodies, G, dt "
+                                         "and epsilon replace the settings above")
+    parser.add_argument("--trajectory", help="trajectory file recording the bodies")
+    parser.add_argument("--trajectory-every", type=int, default=10,
+                        help="steps between recorded frames")
+    parser.add_argument("--trajectory-float32", action="store_true",
+                        help="store trajectory frames as float32 (half the size)")
+    return parser.parse_args(argv)
+
+
+def build_bodies(args, center, sun_mass=1, g_factor=1, two_galaxies=False):
+    """Create the same initial bodies as the interactive script would.
+
+    Returns (positions, velocities, masses, layer, galaxy) where ``layer``
+    holds the ring of each body (-1 for a central mass) and ``galaxy`` the
+    index of the galaxy it belongs to.
+    """
+    layers = make_layers(args.bodies_per_layer, args.layer_factor, args.speed_mult, g_factor)
+    options = {"profile": args.profile, "scale": args.scale, "equilibrium": args.equilibrium,
+               "speed_mult": args.speed_mult, "G": args.G, "epsilon": args.epsilon,
+               "seed": args.seed}
+    cx, cy = center
+    if not two_galaxies:
+        positions, velocities, masses, layer = build_disk(layers, cx, cy, args.center_mass,
+                                                          sun_mass, **options)
+        return positions, velocities, masses, layer, np.zeros(len(masses), dtype=np.int64)
+
+    centers = galaxy_centers(args.galaxies, cx, cy, args.intergalactic_dist)
+    return galaxies(layers, centers, args.center_mass, sun_mass, **options)
+
+
+def conserved_quantities(positions, velocities, masses, G, epsilon, center, engine):
+    # Always evaluated in double precision, so drifts compare across precision modes
+    positions, velocities, masses = (np.asarray(a, dtype=float)
+                                     for a in (positions, velocities, masses))
+    ke = kinetic_energy(velocities, masses)
+    pe = engine(positions, masses, G, epsilon, potential=True)[1]
+    return {"angular_momentum": angular_momentum(positions, velocities, masses, *center),
+            "kinetic": ke, "potential": pe, "total_energy": ke + pe}
+
+
+def main(argv, defaults, two_galaxies=False):
+    args = parse_args(argv, defaults, two_galaxies)
+    center = defaults["center"]
+    first_step = 0
+    if args.resume:
+        arrays, saved = load_checkpoint(args.resume)
+        positions, velocities, masses, layer, galaxy = (
+            arrays["positions"], arrays["velocities"], arrays["masses"], arrays.get("layer"),
+            arrays["galaxy"])
+        args.G, args.dt, args.epsilon = saved["G"], saved["dt"], saved["epsilon"]
+        args.center_mass = saved.get("mass_center", args.center_mass)
+        args.speed_mult = saved.get("speed_multiplier", args.speed_mult)
+        args.layer_factor = saved.get("layer_factor", args.layer_factor)
+        args.bodies_per_layer = saved.get("num", args.bodies_per_layer)
+        first_step = saved["step"]
+        layers = saved["layers"]
+        centers = saved.get("centers")
+        print(f"Resumed {len(masses)} bodies at step {first_step} from {args.resume}")
+    else:
+        positions, velocities, masses, layer, galaxy = build_bodies(
+            args, center, defaults.get("sun_mass", 1), defaults.get("g_factor", 1), two_galaxies)
+        layers = make_layers(args.bodies_per_layer, args.layer_factor, args.speed_mult,
+                             defaults.get("g_factor", 1))
+        centers = None
+    if two_galaxies and centers is None:
+        centers = [list(c) for c in galaxy_centers(args.galaxies, *center,
+                                                   args.intergalactic_dist)]
+    # The settings the interactive scripts restore besides G, dt and epsilon
+    scene = {"mass_center": args.center_mass, "speed_multiplier": args.speed_mult,
+             "layer_factor": args.layer_factor, "num": args.bodies_per_layer}
+    if two_galaxies:
+        scene["centers"] = centers
+    # Merging removes bodies, so they live in a body store; its views are
+    # read again after every change of size
+    bodies = Particles.from_arrays(positions, velocities, masses, layer, galaxy,
+                                   dtype=storage_dtype(args.precision))
+    positions, velocities, masses, galaxy = (bodies.positions, bodies.velocities,
+                                             bodies.masses, bodies.galaxy)
+    start_bodies = len(bodies)
+
+    def checkpoint(step):
+        save_checkpoint(args.checkpoint, bodies.positions, bodies.velocities, bodies.masses,
+                        bodies.galaxy, layer=bodies.layer, G=args.G, dt=args.dt,
+                        epsilon=args.epsilon, layers=layers, step=first_step + step, **scene)
+    engine = make_engine(args.engine, theta=args.theta, workers=args.workers, grid=args.grid,
+                         precision=args.precision)
+    integrator = make_integrator(args.integrator, engine)
+    initial = conserved_quantities(positions, velocities, masses, args.G, args.epsilon,
+                                   center, engine)
+
+    trajectory = None
+    if args.trajectory:
+        # A batch run keeps every frame: wait for the writer rather than drop
+        trajectory = TrajectoryWriter(args.trajectory, args.trajectory_every,
+                                      args.trajectory_float32, drop=False)
+        trajectory.write(first_step, positions, velocities, masses)
+
+    step = 0
+    encounters = 0
+    t0 = time.perf_counter()
+    try:
+        while step < args.steps:
+            integrator.step(positions, velocities, masses, args.G, args.dt, args.epsilon)
+            step += 1
+            if args.capture_radius > 0 and not args.merge:
+                encounters += len(close_pairs(positions, args.capture_radius)[0])
+            elif args.capture_radius > 0 and merge_encounters(bodies, args.capture_radius):
+                positions, velocities, masses, galaxy = (bodies.positions, bodies.velocities,
+                                                         bodies.masses, bodies.galaxy)
+                integrator.reset()
+            if trajectory is not None:
+                trajectory.write(first_step + step, positions, velocities, masses)
+            if args.checkpoint and args.checkpoint_every and step % args.checkpoint_every == 0:
+                checkpoint(step)
+    except KeyboardInterrupt:
+        print(f"Interrupted after {step} steps")
+    elapsed = time.perf_counter() - t0
+    if trajectory is not None:
+        trajectory.close()
+        print(f"{trajectory.frames} trajectory frames written to {args.trajectory}")
+    if args.checkpoint:
+        checkpoint(step)
+        print(f"Checkpoint at step {first_step + step} written to {args.checkpoint}")
+
+    final = conserved_quantities(positions, velocities, masses, args.G, args.epsilon,
+                                 center, engine)
+    settings = {k: v for k, v in vars(args).items()
+                if k not in ("headless", "output", "checkpoint", "resume", "trajectory")}
+    np.savez(args.output, positions=positions, velocities=velocities, masses=masses,
+             galaxy=galaxy, step=step, elapsed=elapsed,
+             force_evaluations=integrator.evaluations,
+             **{f"setting_{k}": v for k, v in settings.items()},
+             **{f"initial_{k}": v for k, v in initial.items()},
+             **{f"final_{k}": v for k, v in final.items()})
+
+    rate = step / elapsed if elapsed > 0 else float("inf")
+    print(f"{len(masses)} bodies, {step} steps in {elapsed:.2f} s ({rate:.1f} steps/s), "
+          f"engine {args.engine}, integrator {args.integrator}, {args.precision}, "
+          f"{round(integrator.evaluations, 1)} force evaluations")
+    if args.capture_radius > 0 and args.merge:
+        print(f"{start_bodies - len(masses)} bodies merged away within {args.capture_radius:g}")
+    elif args.capture_radius > 0:
+        print(f"{encounters} close encounters within {args.capture_radius:g} "
+              f"(pairs summed over the steps)")
+    for key in ("total_energy", "angular_momentum"):
+        drift = (final[key] - initial[key]) / abs(initial[key]) if initial[key] else 0.0
+        print(f"{key:>16}: {initial[key]:.6g} -> {final[key]:.6g} (relative drift {drift:+.2e})")
+    print(f"Final state written to {args.output}")
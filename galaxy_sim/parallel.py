@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-core force evaluation over shared memory.
+
+Positions and masses are copied once per step into shared-memory arrays
+that every worker process maps directly, so no body data is pickled. The
+upper-triangular tiles of the interaction matrix (see
+``gravity.accumulate_tiles``) are split into one contiguous run per worker;
+each worker writes its partial accelerations in place into its own slice of
+a shared (workers, N, 2) buffer, and the parent sums the slices.
+
+    python -m galaxy_sim.parallel --bodies 20000 --workers 1 2 4 8 16 32
+
+measures the speedup over the single-process tiled kernel.
+
+Workers are forked: the simulation scripts have no ``__main__`` guard, so a
+spawned worker would re-run them. Forking a process that already runs other
+threads can deadlock, so the pool is started when the engine is created:
+make it before starting the physics thread or a trajectory writer. By then
+the scripts have already called ``pygame.init()``, whose SIGTERM and SIGINT
+handlers the workers would inherit and which keep them alive when signalled,
+so each worker puts back the default handlers first. The pool is shut down by
+letting the workers finish rather than by signalling them. Where fork is
+unavailable (Windows) the engine falls back to the single-process kernel.
+"""
+
+import argparse
+import atexit
+import multiprocessing
+import os
+import signal
+import time
+import warnings
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from galaxy_sim.gravity import (TILE, accumulate_tiles, direct_accelerations, example_disk,
+                                symmetric_accelerations, tile_pairs)
+
+# Shared buffers attached in this worker process, by shared-memory name
+_attached = {}
+
+
+def _attach(name, size):
+    if name not in _attached:
+        # Drop mappings of buffers the parent has since replaced
+        for old in list(_attached):
+            _attached.pop(old).close()
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray((size,), dtype=float, buffer=_attached[name].buf)
+
+
+def _reset_signals():
+    # Undo handlers inherited from the parent (SDL's), so signals stop workers again
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+
+def _work(task):
+    (name, capacity, workers, index, n, G, epsilon, lo, hi, tile, potential) = task
+    buf = _attach(name, capacity * (3 + 2 * workers))
+    positions = buf[:2 * n].reshape(n, 2)
+    masses = buf[2 * capacity:2 * capacity + n]
+    partial = buf[3 * capacity:].reshape(workers, capacity, 2)[index, :n]
+    partial[:] = 0.0
+    return accumulate_tiles(positions, masses, G, epsilon, tile_pairs(n, tile)[lo:hi],
+                            partial, potential, tile)
+
+
+class ParallelEngine:
+    """Force engine callable that spreads the tiled direct kernel over processes."""
+
+    def __init__(self, workers=None, tile=TILE):
+        self.workers = workers or os.cpu_count() or 1
+        self.tile = tile
+        self.pool = None
+        self.shm = None
+        self.capacity = 0
+        self.warned = False
+        self.forked = "fork" in multiprocessing.get_all_start_methods()
+        if self.forked:
+            # The workers share the parent's resource tracker, started before
+            # the fork, instead of each starting (and cleaning up with) their own
+            resource_tracker.ensure_running()
+            self.pool = multiprocessing.get_context("fork").Pool(self.workers,
+                                                                 _reset_signals)
+        atexit.register(self.close)
+
+    def _ensure_capacity(self, n):
+        if n <= self.capacity:
+            return
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+        self.capacity = max(n, 2 * self.capacity)
+        # One block: positions (2 * cap), masses (cap), per-worker partials (workers * 2 * cap)
+        size = self.capacity * (3 + 2 * self.workers) * 8
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.buf = np.ndarray((self.capacity * (3 + 2 * self.workers),), dtype=float,
+                              buffer=self.shm.buf)
+
+    def __call__(self, positions, masses, G, epsilon, potential=False, targets=None):
+        if targets is not None:
+            # Subsets (block time-steps) are small; not worth a round trip to the pool
+            return direct_accelerations(positions, masses, G, epsilon, targets, potential)
+        if not self.forked:
+            if not self.warned:
+                warnings.warn("fork is not available; using the single-process kernel")
+                self.warned = True
+            return symmetric_accelerations(positions, masses, G, epsilon, potential, self.tile)
+
+        if self.pool is None:
+            raise RuntimeError("the parallel engine has been closed")
+
+        n = len(positions)
+        self._ensure_capacity(n)
+        cap = self.capacity
+        self.buf[:2 * n] = np.asarray(positions, dtype=float).ravel()
+        self.buf[2 * cap:2 * cap + n] = masses
+
+        count = len(tile_pairs(n, self.tile))
+        bounds = np.linspace(0, count, self.workers + 1).astype(int)
+        tasks = [(self.shm.name, cap, self.workers, k, n, G, epsilon,
+                  bounds[k], bounds[k + 1], self.tile, potential)
+                 for k in range(self.workers)]
+        energy = sum(self.pool.map(_work, tasks))
+
+        partial = self.buf[3 * cap:].reshape(self.workers, cap, 2)[:, :n]
+        acc = partial.sum(axis=0)
+        if potential:
+            return acc, energy
+        return acc
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+            self.capacity = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the parallel force engine against the single-process kernel.")
+    parser.add_argument("--bodies", type=int, default=20000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    positions, masses = example_disk(args.bodies)
+
+    def best_time(engine):
+        times = []
+        for _ in range(args.repeats):
+            t0 = time.perf_counter()
+            result = engine(positions, masses, 1.0, 50.0)
+            times.append(time.perf_counter() - t0)
+        return min(times), result
+
+    serial, exact = best_time(symmetric_accelerations)
+    print(f"{args.bodies} bodies, {os.cpu_count()} cores")
+    print(f"single process : {serial:8.3f} s")
+    for workers in args.workers:
+        engine = ParallelEngine(workers)
+        engine(positions, masses, 1.0, 50.0)          # warm up the workers outside the timing
+        elapsed, acc = best_time(engine)
+        engine.close()
+        err = np.abs(acc - exact).max() / np.abs(exact).max()
+        print(f"{workers:3d} workers    : {elapsed:8.3f} s  speedup {serial / elapsed:5.2f}x"
+              f"  (max relative difference {err:.1e})")
+
+
+if __name__ == "__main__":
+    main()
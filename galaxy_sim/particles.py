@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Structure-of-arrays store for the bodies of a running simulation.
+
+Every body field lives in its own contiguous buffer with room to spare:
+positions and velocities as (capacity, 2) floats (x and y side by side,
+the layout every force engine and integrator takes), masses as floats and
+the layer and galaxy of each body as integers (layer -1 is a central mass).
+The float fields are float64 unless another ``dtype`` is given (float32
+halves their memory, see ``galaxy_sim.engines.PRECISIONS``).
+The live bodies are the first ``len(bodies)`` rows, handed out as views, so
+the physics updates the buffers in place and nothing is rebuilt per step.
+
+``append`` doubles the capacity when it runs out, so adding bodies one by
+one costs O(1) amortized; ``swap_remove`` moves the last body into the gap
+in O(1). Views taken before a change of size are stale: read the
+properties again after appending or removing.
+"""
+
+import numpy as np
+
+MIN_CAPACITY = 64
+
+
+class Particles:
+    """Positions, velocities, masses, layer and galaxy ids of the bodies."""
+
+    def __init__(self, capacity=MIN_CAPACITY, dtype=np.float64):
+        self.count = 0
+        self._pos = np.zeros((capacity, 2), dtype=dtype)
+        self._vel = np.zeros((capacity, 2), dtype=dtype)
+        self._mass = np.zeros(capacity, dtype=dtype)
+        self._layer = np.zeros(capacity, dtype=np.int64)
+        self._galaxy = np.zeros(capacity, dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, positions, velocities, masses, layer=None, galaxy=None,
+                    dtype=np.float64):
+        """A store holding copies of the given body arrays."""
+        bodies = cls(max(MIN_CAPACITY, len(masses)), dtype)
+        bodies.extend(positions, velocities, masses, layer, galaxy)
+        return bodies
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return len(self._mass)
+
+    @property
+    def dtype(self):
+        return self._pos.dtype
+
+    @property
+    def positions(self):
+        return self._pos[:self.count]
+
+    @property
+    def velocities(self):
+        return self._vel[:self.count]
+
+    @property
+    def masses(self):
+        return self._mass[:self.count]
+
+    @property
+    def layer(self):
+        return self._layer[:self.count]
+
+    @property
+    def galaxy(self):
+        return self._galaxy[:self.count]
+
+    @property
+    def x(self):
+        return self._pos[:self.count, 0]
+
+    @property
+    def y(self):
+        return self._pos[:self.count, 1]
+
+    @property
+    def vx(self):
+        return self._vel[:self.count, 0]
+
+    @property
+    def vy(self):
+        return self._vel[:self.count, 1]
+
+    def reserve(self, capacity):
+        """Grow the buffers to hold at least ``capacity`` bodies."""
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity, MIN_CAPACITY)
+        for name in ("_pos", "_vel", "_mass", "_layer", "_galaxy"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def append(self, position, velocity, mass, layer=-1, galaxy=0):
+        """Add one body at the end and return its index."""
+        self.reserve(self.count + 1)
+        i = self.count
+        self._pos[i] = position
+        self._vel[i] = velocity
+        self._mass[i] = mass
+        self._layer[i] = layer
+        self._galaxy[i] = galaxy
+        self.count += 1
+        return i
+
+    def extend(self, positions, velocities, masses, layer=None, galaxy=None):
+        """Add many bodies at the end (layer -1 and galaxy 0 when not given)."""
+        n = len(masses)
+        self.reserve(self.count + n)
+        rows = slice(self.count, self.count + n)
+        self._pos[rows] = positions
+        self._vel[rows] = velocities
+        self._mass[rows] = masses
+        self._layer[rows] = -1 if layer is None else layer
+        self._galaxy[rows] = 0 if galaxy is None else galaxy
+        self.count += n
+
+    def swap_remove(self, i):
+        """Remove body ``i`` by moving the last body into its place."""
+        last = self.count - 1
+        if not 0 <= i <= last:
+            raise IndexError(f"body {i} out of range for {self.count} bodies")
+        for buffer in (self._pos, self._vel, self._mass, self._layer, self._galaxy):
+            buffer[i] = buffer[last]
+        self.count = last
+
+    def clear(self):
+        """Remove every body, keeping the capacity."""
+        self.count = 0
+
+    def members(self, layer, galaxy=None):
+        """Indices of the bodies of ``layer`` (in ``galaxy``, if given)."""
+        mask = self.layer == layer
+        if galaxy is not None:
+            mask &= self.galaxy == galaxy
+        return np.flatnonzero(mask)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Per-phase frame timing for the interactive scripts.
+
+The main loop is cut into phases:
+
+    events   pygame event handling
+    forces   force passes of the engine
+    update   the integrator's own work (kicks and drifts)
+    stats    energy and angular momentum diagnostics
+    draw     bodies, controls, HUD and the display update
+
+The drawing thread marks the end of its sections with ``lap(phase)``;
+functions that may run on the physics thread are timed through ``wrap`` /
+``call``. Nested timed calls count only for the innermost phase, and their
+time is taken out of the surrounding lap, so a force pass inside the drawing
+loop (physics without the worker thread) is not also counted as drawing.
+``end_frame()`` closes a frame: the physics phases hold whatever ran on the
+worker since the previous frame.
+
+A rolling window of frames gives the mean and 95th percentile per phase for
+the on-screen overlay; with ``csv_path`` every frame is also written to a
+CSV file. While disabled every entry point returns after one attribute test.
+"""
+
+import collections
+import csv
+import threading
+import time
+
+import numpy as np
+
+PHASES = ("events", "forces", "update", "stats", "draw")
+WINDOW = 120               # frames in the rolling statistics
+REFRESH = 15               # frames between updates of the overlay text
+
+
+class Profiler:
+    """Phase timers, rolling statistics and optional CSV log."""
+
+    def __init__(self, phases=PHASES, window=WINDOW, csv_path=None, enabled=False):
+        self.phases = phases
+        self.enabled = enabled or csv_path is not None
+        self.frames = collections.deque(maxlen=window)
+        self.totals = dict.fromkeys(phases, 0.0)
+        self.steps = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.frame_start = None
+        self.frame_count = 0
+        self.lines = None
+        self.lines_frame = 0
+        self.csv_file = self.csv = None
+        if csv_path is not None:
+            self.csv_file = open(csv_path, "w", newline="")
+            self.csv = csv.writer(self.csv_file)
+            self.csv.writerow(["frame", "time_s", "frame_ms"]
+                              + [f"{p}_ms" for p in phases] + ["steps", "bodies"])
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frame_start = None
+        self.local = threading.local()
+
+    def _add(self, phase, seconds):
+        with self.lock:
+            self.totals[phase] += seconds
+
+    def begin(self):
+        """Start a frame's first section on the calling thread."""
+        if self.enabled:
+            self.local.mark = time.perf_counter()
+
+    def lap(self, phase):
+        """Charge the time since the last mark on this thread to ``phase``."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        mark = getattr(self.local, "mark", None)
+        if mark is not None:
+            self._add(phase, now - mark)
+        self.local.mark = now
+
+    def call(self, phase, func, *args, **kwargs):
+        """Call ``func`` and charge the time it takes (minus nested phases) to ``phase``."""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        local = self.local
+        if not hasattr(local, "stack"):
+            local.stack = []
+        entry = [time.perf_counter(), 0.0]         # start, time in nested calls
+        local.stack.append(entry)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            total = time.perf_counter() - entry[0]
+            local.stack.pop()
+            self._add(phase, total - entry[1])
+            if local.stack:
+                local.stack[-1][1] += total
+            elif getattr(local, "mark", None) is not None:
+                local.mark += total                # not part of the surrounding lap
+
+    def wrap(self, phase, func):
+        """``func`` timed as ``phase`` on every call."""
+        def timed(*args, **kwargs):
+            return self.call(phase, func, *args, **kwargs)
+        return timed
+
+    def count_step(self):
+        if self.enabled:
+            with self.lock:
+                self.steps += 1
+
+    def end_frame(self, bodies):
+        """Close the frame drawn with ``bodies`` bodies and record its timings."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            totals, self.totals = self.totals, dict.fromkeys(self.phases, 0.0)
+            steps, self.steps = self.steps, 0
+        if self.frame_start is not None:
+            row = [now - self.frame_start] + [totals[p] for p in self.phases] + [steps, bodies]
+            self.frames.append(row)
+            self.frame_count += 1
+            if self.csv is not None:
+                self.csv.writerow([self.frame_count, f"{now:.6f}"]
+                                  + [f"{1e3 * v:.4f}" for v in row[:-2]] + row[-2:])
+        self.frame_start = now
+
+    def summary(self):
+        """Lines for the overlay: mean / p95 ms per phase and bodies per second.
+
+        Recomputed every ``REFRESH`` frames, so the numbers stay readable.
+        """
+        if not self.frames:
+            return ["profiler: collecting..."]
+        if self.lines is not None and self.frame_count - self.lines_frame < REFRESH:
+            return self.lines
+        data = np.array(self.frames)
+        ms = 1e3 * data[:, :-2]
+        names = ("frame",) + tuple(self.phases)
+        lines = [f"{name:>6}: {mean:6.2f} ms mean {p95:6.2f} ms p95"
+                 for name, mean, p95 in zip(names, ms.mean(axis=0),
+                                            np.percentile(ms, 95, axis=0))]
+        rate = (data[:, -2] * data[:, -1]).sum() / data[:, 0].sum()
+        lines.append(f"{rate:,.0f} bodies/s ({data[:, -2].sum() / data[:, 0].sum():.1f} steps/s)")
+        self.lines, self.lines_frame = lines, self.frame_count
+        return lines
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = self.csv = None
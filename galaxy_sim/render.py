@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Offline renderer: trajectory file -> numbered PNG images.
+
+    python -m galaxy_sim.render run.traj frames/ --width 3840 --height 2560 --workers 8
+
+Every frame is drawn on a black background with the bodies coloured by mass
+from the scripts' palette. ``--view`` picks the rectangle of simulation
+coordinates shown (the scripts' 1500 x 1000 window by default), which is
+scaled to the output size, so the resolution is independent of the window
+the run was watched in. Frames are spread over worker processes, each
+opening the trajectory itself and reading only the frames it draws.
+
+The PNGs are written with zlib alone, so rendering needs neither pygame nor
+a display. Join them into a movie with e.g.
+``ffmpeg -framerate 60 -i frames/frame_%06d.png movie.mp4``.
+"""
+
+import argparse
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from galaxy_sim.scene import COLORS, color_index
+from galaxy_sim.trajectory import Trajectory
+
+PALETTE = np.array(COLORS, dtype=np.uint8)
+
+# Trajectory opened in this worker process, by path
+_opened = {}
+
+
+def write_png(path, image):
+    """Write an (H, W, 3) uint8 array as an 8-bit RGB PNG."""
+    height, width, _ = image.shape
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, 3 * width)
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def disc_offsets(radius):
+    """Pixel offsets (dy, dx) covered by a filled disc of the given radius."""
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx * dx + dy * dy <= radius * radius
+    return dy[inside], dx[inside]
+
+
+def rasterize(positions, colors, width, height, view, radius):
+    """Draw discs of the given colours at ``positions`` into a new RGB image.
+
+    ``view`` is (x0, y0, x1, y1) in simulation coordinates, mapped onto the
+    whole image; bodies outside it are skipped. Later bodies cover earlier
+    ones, as with successive draw calls.
+    """
+    x0, y0, x1, y1 = view
+    px = np.rint((positions[:, 0] - x0) * (width / (x1 - x0))).astype(np.int64)
+    py = np.rint((positions[:, 1] - y0) * (height / (y1 - y0))).astype(np.int64)
+    r = int(np.ceil(radius))
+    visible = (px >= -r) & (px < width + r) & (py >= -r) & (py < height + r)
+    px, py, colors = px[visible], py[visible], colors[visible].astype(np.uint32)
+
+    # Stamp on a canvas with a 2r-pixel border, so discs crossing the edge
+    # need no clipping, one packed 0x00BBGGRR word per pixel. The words are
+    # little-endian whatever the machine, so their bytes read R, G, B, 0
+    border = 2 * r
+    stride = width + 2 * border
+    canvas = np.zeros((height + 2 * border) * stride, dtype="<u4")
+    dy, dx = disc_offsets(radius)
+    offsets = dy * stride + dx
+    centres = (py + border) * stride + (px + border)
+    packed = colors[:, 0] | (colors[:, 1] << 8) | (colors[:, 2] << 16)
+    canvas[centres[:, np.newaxis] + offsets] = packed[:, np.newaxis]
+
+    canvas = canvas.reshape(height + 2 * border, stride)[border:border + height,
+                                                         border:border + width]
+    return canvas.view(np.uint8).reshape(height, width, 4)[:, :, :3].copy()
+
+
+def _render(task):
+    (path, frame, out, width, height, view, radius, sun_mass) = task
+    if path not in _opened:
+        _opened[path] = Trajectory(path)
+    step, positions, _, masses = _opened[path][frame]
+    colors = PALETTE[color_index(masses, sun_mass)]
+    image = rasterize(positions.astype(float), colors, width, height, view, radius)
+    write_png(out, image)
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render the frames of a trajectory file to PNG images.")
+    parser.add_argument("trajectory")
+    parser.add_argument("output_dir")
+    parser.add_argument("--width", type=int, default=1500)
+    parser.add_argument("--height", type=int, default=1000)
+    parser.add_argument("--view", type=float, nargs=4, default=[0, 0, 1500, 1000],
+                        metavar=("X0", "Y0", "X1", "Y1"),
+                        help="simulation rectangle shown (default: the scripts' window)")
+    parser.add_argument("--radius", type=float, default=None,
+                        help="body radius in output pixels (default: 5 scaled to the output)")
+    parser.add_argument("--sun-mass", type=float, default=1,
+                        help="mass of the first palette colour")
+    parser.add_argument("--frames", type=int, nargs=2, metavar=("START", "STOP"),
+                        help="range of frames to render (default: all)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes to render with (0 = one per core)")
+    args = parser.parse_args()
+
+    count = len(Trajectory(args.trajectory))
+    frames = range(*args.frames) if args.frames else range(count)
+    frames = [k for k in frames if 0 <= k < count]
+    radius = args.radius
+    if radius is None:
+        # The scripts draw radius-5 circles in a window at the view's scale
+        radius = 5 * args.width / (args.view[2] - args.view[0])
+    os.makedirs(args.output_dir, exist_ok=True)
+    tasks = [(args.trajectory, k, os.path.join(args.output_dir, f"frame_{k:06d}.png"),
+              args.width, args.height, tuple(args.view), radius, args.sun_mass)
+             for k in frames]
+
+    workers = args.workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        for done, _ in enumerate(pool.imap_unordered(_render, tasks), 1):
+            if done % 100 == 0 or done == len(tasks):
+                print(f"{done}/{len(tasks)} frames", flush=True)
+    elapsed = time.perf_counter() - t0
+    print(f"Rendered {len(tasks)} frames at {args.width}x{args.height} in {elapsed:.1f} s "
+          f"with {workers} workers into {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
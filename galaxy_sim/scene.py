@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Initial conditions shared by the interactive scripts and the headless runner.
+
+A galaxy is a set of concentric rings ("layers") of equally spaced bodies on
+circular orbits around a heavy central mass. Body masses cycle through the
+26-colour mass palette: the k-th body created gets (k % 26 + 1) * sun_mass.
+
+Besides the rings, ``build_disk`` draws bodies from smooth radial profiles
+(an exponential disk or a Plummer bulge) in bulk, and can replace the
+layer-table speeds by circular velocities from the mass enclosed by each
+orbit, central mass included, so a run starts close to equilibrium.
+
+``add_layer_body`` and ``remove_layer_body`` change one ring of a running
+simulation held in a ``Particles`` store without touching the other bodies.
+"""
+
+import numpy as np
+
+# Mass palette of the scripts: colour k is drawn for mass (k + 1) * sun_mass,
+# from red (lightest) to magenta (heaviest)
+COLORS = [
+    (255,   0,   0), (255,  50,   0), (255, 101,   0), (255, 152,   0),
+    (255, 203,   0), (255, 254,   0), (204, 255,   0), (153, 255,   0),
+    (102, 255,   0), ( 51, 255,   0), (  0, 255,   0), (  0, 255,  50),
+    (  0, 255, 101), (  0, 255, 152), (  0, 255, 203), (  0, 255, 254),
+    (  0, 204, 255), (  0, 153, 255), (  0, 102, 255), (  0,  51, 255),
+    (  0,   0, 255), ( 50,   0, 255), (101,   0, 255), (152,   0, 255),
+    (203,   0, 255), (254,   0, 255),
+]
+
+# Number of colours (and therefore distinct masses) in the palette
+NUM_COLORS = len(COLORS)
+
+# Radial distributions of build_disk: the layer rings, an exponential disk
+# (surface density ~ exp(-R / scale)) and a Plummer bulge seen face-on
+# (surface density ~ (1 + R**2 / scale**2) ** -2)
+PROFILES = ("rings", "exponential", "plummer")
+
+# (radius, speed) of each layer before Layer_Factor / speed scaling
+LAYER_TABLE = [(10, 10.0), (20, 8.2), (30, 7.1), (40, 6.3), (50, 5.8),
+               (60, 5.2), (70, 4.6), (80, 4.0), (90, 3.5), (100, 3.0)]
+
+
+def color_index(masses, sun_mass=1):
+    """Palette index of each mass, clamped to the palette (the centre is the last colour)."""
+    index = np.asarray(masses, dtype=float) / sun_mass - 1
+    return np.clip(index.astype(np.int64), 0, NUM_COLORS - 1)
+
+
+def make_layers(num, layer_factor, speed_multiplier, g_factor=1):
+    """Return the layer table as the list of dicts used by the scripts."""
+    return [{"num": num, "radius": r * layer_factor, "speed": s * g_factor * speed_multiplier}
+            for r, s in LAYER_TABLE]
+
+
+def disk(layers, center_x, center_y, mass_center, sun_mass=1, first_color=0):
+    """Bodies of every layer followed by the central mass.
+
+    ``first_color`` offsets the palette index of the first body, so a second
+    galaxy can continue the colour sequence of the first one.
+    Returns (positions, velocities, masses) as float arrays.
+    """
+    positions, velocities = [], []
+    for layer in layers:
+        num = layer["num"]
+        angle = 2 * np.pi / num * np.arange(num) + np.pi / num if num else np.zeros(0)
+        positions.append(np.column_stack((center_x + layer["radius"] * np.cos(angle),
+                                          center_y + layer["radius"] * np.sin(angle))))
+        velocities.append(np.column_stack((-layer["speed"] * np.sin(angle),
+                                            layer["speed"] * np.cos(angle))))
+    positions.append([(center_x, center_y)])
+    velocities.append([(0.0, 0.0)])
+
+    positions = np.concatenate(positions).astype(float)
+    velocities = np.concatenate(velocities).astype(float)
+    masses = ((np.arange(len(positions) - 1) + first_color) % NUM_COLORS + 1) * float(sun_mass)
+    masses = np.append(masses, float(mass_center))
+    return positions, velocities, masses
+
+
+def circular_velocities(offsets, masses, mass_center, G=1, epsilon=50):
+    """Velocities of circular orbits for bodies at ``offsets`` from a central mass.
+
+    Each body is held by the central mass plus every body closer to the
+    centre, treated as concentrated there, under the scripts' softened law:
+    v**2 / r = G * M(<r) / (r + epsilon)**2. Orbits run counter-clockwise,
+    as the layer rings do.
+    """
+    r = np.hypot(offsets[:, 0], offsets[:, 1])
+    order = np.argsort(r)
+    enclosed = np.empty(len(r))
+    enclosed[order] = mass_center + np.cumsum(masses[order]) - masses[order]
+    speed = np.sqrt(G * enclosed * r) / (r + epsilon)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        scale = np.where(r > 0, speed / r, 0.0)
+    return np.column_stack((-offsets[:, 1] * scale, offsets[:, 0] * scale))
+
+
+def sample_offsets(profile, count, scale, rng):
+    """``count`` positions relative to the centre drawn from a radial profile."""
+    u = rng.random(count)
+    if profile == "exponential":
+        # R * exp(-R / scale) is the Gamma(2, scale) density
+        radius = rng.gamma(2.0, scale, count)
+    elif profile == "plummer":
+        # Inverse of the enclosed fraction R**2 / (R**2 + scale**2)
+        radius = scale * np.sqrt(u / (1.0 - u))
+        u = rng.random(count)
+    else:
+        raise ValueError(f"unknown profile {profile!r}, expected one of {', '.join(PROFILES)}")
+    angle = 2 * np.pi * u
+    return np.column_stack((radius * np.cos(angle), radius * np.sin(angle)))
+
+
+def nearest_layer(offsets, layers):
+    """Index of the layer whose ring radius is closest to each offset's radius."""
+    radii = np.array([layer["radius"] for layer in layers], dtype=float)
+    order = np.argsort(radii)
+    edges = (radii[order][1:] + radii[order][:-1]) / 2
+    return order[np.searchsorted(edges, np.hypot(offsets[:, 0], offsets[:, 1]))]
+
+
+def build_disk(layers, center_x, center_y, mass_center, sun_mass=1, first_color=0,
+               profile="rings", scale=100.0, equilibrium=False, speed_mult=1.0,
+               G=1, epsilon=50, seed=0):
+    """One galaxy as (positions, velocities, masses, layer), central mass last.
+
+    ``rings`` places the layers exactly as ``disk`` does. ``exponential`` and
+    ``plummer`` draw as many bodies as the layers hold from that profile
+    with radial ``scale``, on circular orbits from the enclosed mass, and
+    assign each to the nearest layer ring. With ``equilibrium`` the rings
+    get such orbits too instead of the layer-table speeds. Derived speeds
+    are multiplied by ``speed_mult``.
+    """
+    if profile == "rings":
+        positions, velocities, masses = disk(layers, center_x, center_y, mass_center,
+                                             sun_mass, first_color)
+        layer = layer_ids(layers)
+        offsets = positions[:-1] - (center_x, center_y)
+    else:
+        count = sum(layer["num"] for layer in layers)
+        offsets = sample_offsets(profile, count, scale, np.random.default_rng(seed))
+        positions = np.vstack((offsets + (center_x, center_y), [(center_x, center_y)]))
+        velocities = np.zeros((count + 1, 2))
+        masses = np.append(((np.arange(count) + first_color) % NUM_COLORS + 1) * float(sun_mass),
+                           float(mass_center))
+        layer = np.append(nearest_layer(offsets, layers), -1)
+        equilibrium = True
+    if equilibrium:
+        velocities[:-1] = speed_mult * circular_velocities(offsets, masses[:-1], mass_center,
+                                                           G, epsilon)
+    return positions, velocities, masses, layer
+
+
+def layer_ids(layers):
+    """Layer index of every body made by ``disk`` (-1 for the central mass)."""
+    return np.append(np.repeat(np.arange(len(layers)), [layer["num"] for layer in layers]), -1)
+
+
+def galaxy_centers(count, center_x, center_y, spacing):
+    """Centres of ``count`` galaxies placed ``spacing`` apart along x around a point."""
+    return [(center_x + int((k - (count - 1) / 2) * spacing), center_y) for k in range(count)]
+
+
+def galaxies(layers, centers, mass_center, sun_mass=1, **options):
+    """One combined body set holding a galaxy around each of ``centers``.
+
+    Each galaxy continues the colour sequence of the previous one; ``options``
+    (profile, scale, equilibrium, ...) are passed to ``build_disk``, with a
+    different random seed per galaxy. Returns (positions, velocities, masses,
+    layer, galaxy) where ``galaxy`` is the index of the galaxy every body
+    belongs to.
+    """
+    parts = []
+    first_color = 0
+    seed = options.pop("seed", 0)
+    for k, (cx, cy) in enumerate(centers):
+        parts.append(build_disk(layers, cx, cy, mass_center, sun_mass, first_color,
+                                seed=seed + k, **options))
+        first_color += len(parts[-1][0]) - 1
+    galaxy = np.repeat(np.arange(len(parts)), [len(p[0]) for p in parts])
+    if not parts:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0), galaxy.copy(), galaxy
+    return tuple(np.concatenate([p[k] for p in parts]) for k in range(4)) + (galaxy,)
+
+
+def add_layer_body(bodies, layers, index, galaxy=0, sun_mass=1):
+    """Append one body to ring ``index`` of ``galaxy`` and return its index.
+
+    The body is placed on the ring's circle around the galaxy's central mass,
+    in the middle of the widest gap between the ring's current bodies, with
+    the ring's orbital speed on top of the centre's own motion. Its mass
+    continues the palette sequence of the satellites. A galaxy without a
+    central mass is centred on its bodies' centre of mass instead; one with
+    no bodies left gets none and None is returned.
+    """
+    layer = layers[index]
+    centre = bodies.members(-1, galaxy)
+    if not len(centre):
+        centre = np.flatnonzero(bodies.galaxy == galaxy)
+        if not len(centre):
+            return None
+    weights = bodies.masses[centre] / bodies.masses[centre].sum()
+    cx, cy = weights @ bodies.positions[centre]
+    ring = bodies.members(index, galaxy)
+    if len(ring):
+        angles = np.sort(np.arctan2(bodies.y[ring] - cy, bodies.x[ring] - cx))
+        gaps = np.diff(np.append(angles, angles[0] + 2 * np.pi))
+        widest = np.argmax(gaps)
+        angle = angles[widest] + gaps[widest] / 2
+    else:
+        angle = np.pi                      # where disk() puts a ring of one
+    position = (cx + layer["radius"] * np.cos(angle), cy + layer["radius"] * np.sin(angle))
+    velocity = weights @ bodies.velocities[centre] + (-layer["speed"] * np.sin(angle),
+                                            layer["speed"] * np.cos(angle))
+    satellites = np.count_nonzero(bodies.layer >= 0)
+    mass = (satellites % NUM_COLORS + 1) * float(sun_mass)
+    return bodies.append(position, velocity, mass, index, galaxy)
+
+
+def remove_layer_body(bodies, index, galaxy=0):
+    """Remove the most recently stored body of ring ``index`` of ``galaxy``.
+
+    Returns False if the ring is already empty.
+    """
+    ring = bodies.members(index, galaxy)
+    if not len(ring):
+        return False
+    bodies.swap_remove(ring[-1])
+    return True
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps: many headless runs over a grid of start-screen settings.
+
+    python -m galaxy_sim.sweep --vary dt=0.25,0.5,1 epsilon=25,50 --steps 2000
+    python -m galaxy_sim.sweep --scene two-galaxies --vary intergalactic_dist=200,300,400
+    python -m galaxy_sim.sweep --configs runs.json --output runs.csv
+
+Each configuration is the scripts' start-screen defaults with some settings
+replaced: every combination of the ``--vary`` lists, applied to every entry
+of the ``--configs`` JSON list (a list of dicts of settings) if one is
+given. The runs are spread over a process pool and each produces
+
+    energy_drift     relative change of the total energy
+    momentum_drift   relative change of the angular momentum
+    radius_<k>       final mean distance of layer k's bodies from their
+                     galaxy's central mass (averaged over the galaxies)
+    wall_time        seconds the run took
+
+Results are cached as one JSON file per run in ``--cache``, named by a hash
+of the settings that affect it (``theta`` only counts for Barnes-Hut and
+``grid`` only for the particle mesh), so repeating or extending a sweep
+only runs the configurations not seen before. The table of all runs is written as CSV.
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from galaxy_sim.engines import ENGINES, make_engine
+from galaxy_sim.headless import DISK_OPTIONS, SETTINGS, build_bodies, conserved_quantities
+from galaxy_sim.integrators import INTEGRATORS, make_integrator
+from galaxy_sim.scene import make_layers
+
+SCENES = ("disk", "two-galaxies")
+CACHE_VERSION = 1          # bump when a change to the physics invalidates cached results
+
+# Start-screen defaults of the scripts plus the run options
+DEFAULTS = {**{k: v for k, v in SETTINGS.items() if k != "center"},
+            "engine": "direct", "integrator": "euler", "theta": 0.5, "grid": 256, "steps": 1000}
+INTEGER = ("bodies_per_layer", "galaxies", "grid", "steps")
+TEXT = ("engine", "integrator")
+CHOICES = {"engine": ENGINES, "integrator": INTEGRATORS}
+# Settings read by one engine only, which must not split the cache of the others
+ENGINE_SETTINGS = {"theta": "barnes-hut", "grid": "particle-mesh"}
+
+CENTER = SETTINGS["center"]
+
+
+def parse_value(name, text):
+    if name in TEXT:
+        return text
+    return int(text) if name in INTEGER else float(text)
+
+
+def config_key(config):
+    """Hash of everything that determines a run's result."""
+    config = {name: value for name, value in config.items()
+              if ENGINE_SETTINGS.get(name, config["engine"]) == config["engine"]}
+    text = json.dumps({"version": CACHE_VERSION, **config}, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:20]
+
+
+def build_configs(scene, base, vary):
+    """Every combination of ``vary`` ({name: [values]}) on top of each dict in ``base``.
+
+    Settings that are not in ``DEFAULTS``, and engine or integrator names
+    that do not exist, raise ValueError. Configurations
+    that come out the same (e.g. different galaxy spacings of the single
+    disk) are returned once.
+    """
+    names = list(vary)
+    for overrides in [vary] + list(base):
+        if not isinstance(overrides, dict):
+            raise ValueError(f"settings must be a dict, not {overrides!r}")
+        unknown = [name for name in overrides if name not in DEFAULTS]
+        if unknown:
+            raise ValueError(f"unknown settings {', '.join(map(str, unknown))}; "
+                             f"expected some of {', '.join(DEFAULTS)}")
+    for name, choices in CHOICES.items():
+        values = vary.get(name, []) + [overrides[name] for overrides in base if name in overrides]
+        wrong = [str(value) for value in values if value not in choices]
+        if wrong:
+            raise ValueError(f"unknown {name} {', '.join(wrong)}; "
+                             f"expected one of {', '.join(choices)}")
+    configs = {}
+    for overrides in base:
+        for values in itertools.product(*(vary[n] for n in names)):
+            config = {"scene": scene, **DEFAULTS, **overrides, **dict(zip(names, values))}
+            if scene == "disk":
+                # Settings the single galaxy does not have must not split the cache
+                config.pop("intergalactic_dist")
+                config.pop("galaxies")
+            # 1 and 1.0 from a JSON file are the same run
+            config.update({name: float(value) for name, value in config.items()
+                           if name in DEFAULTS and name not in INTEGER + TEXT})
+            configs.setdefault(config_key(config), config)
+    return list(configs.values())
+
+
+def run_config(config):
+    """Run one configuration headlessly and return ``(config, metrics)``."""
+    t0 = time.perf_counter()
+    # The bodies a headless run of the same settings starts from
+    args = argparse.Namespace(**{**DISK_OPTIONS, **config})
+    positions, velocities, masses, layer, galaxy = build_bodies(
+        args, CENTER, two_galaxies=config["scene"] != "disk")
+    layers = make_layers(config["bodies_per_layer"], config["layer_factor"], config["speed_mult"])
+
+    G, dt, epsilon = config["G"], config["dt"], config["epsilon"]
+    engine = make_engine(config["engine"], theta=config["theta"], grid=config["grid"])
+    integrator = make_integrator(config["integrator"], engine)
+    initial = conserved_quantities(positions, velocities, masses, G, epsilon, CENTER, engine)
+    for _ in range(config["steps"]):
+        integrator.step(positions, velocities, masses, G, dt, epsilon)
+    final = conserved_quantities(positions, velocities, masses, G, epsilon, CENTER, engine)
+
+    metrics = {}
+    for key, name in (("total_energy", "energy_drift"), ("angular_momentum", "momentum_drift")):
+        metrics[name] = (final[key] - initial[key]) / abs(initial[key]) if initial[key] else 0.0
+    # Distance of every satellite from the central mass of its own galaxy
+    centre_of = np.flatnonzero(layer == -1)[galaxy]
+    distance = np.hypot(*(positions - positions[centre_of]).T)
+    for k in range(len(layers)):
+        ring = layer == k
+        metrics[f"radius_{k}"] = float(distance[ring].mean()) if ring.any() else float("nan")
+    metrics["bodies"] = len(masses)
+    metrics["wall_time"] = time.perf_counter() - t0
+    return config, metrics
+
+
+def load_cached(cache_dir, config):
+    path = os.path.join(cache_dir, config_key(config) + ".json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["metrics"]
+
+
+def store(cache_dir, config, metrics):
+    # Written under a temporary name and renamed, as checkpoints are
+    path = os.path.join(cache_dir, config_key(config) + ".json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"config": config, "metrics": metrics}, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a grid of simulation settings headlessly, caching every result.")
+    parser.add_argument("--scene", choices=SCENES, default="disk")
+    parser.add_argument("--vary", nargs="+", default=[], metavar="NAME=V1,V2,...",
+                        help=f"settings to sweep: {', '.join(DEFAULTS)}")
+    parser.add_argument("--configs", help="JSON file with a list of settings dicts")
+    parser.add_argument("--steps", type=int, help="steps per run (default "
+                                                  f"{DEFAULTS['steps']}, or from the configs)")
+    parser.add_argument("--engine", choices=ENGINES)
+    parser.add_argument("--integrator", choices=INTEGRATORS)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes to run with (0 = one per core)")
+    parser.add_argument("--cache", default="sweep_cache", help="directory of cached results")
+    parser.add_argument("--output", default="sweep.csv", help="CSV table of all runs")
+    args = parser.parse_args()
+
+    vary = {}
+    for item in args.vary:
+        name, _, values = item.partition("=")
+        if name not in DEFAULTS or not values:
+            parser.error(f"--vary expects NAME=V1,V2,... with NAME one of {', '.join(DEFAULTS)}")
+        try:
+            vary[name] = [parse_value(name, v) for v in values.split(",")]
+        except ValueError:
+            parser.error(f"--vary {name}: cannot read {values!r} as numbers")
+    for name in ("steps", "engine", "integrator"):
+        if getattr(args, name) is not None:
+            vary.setdefault(name, [getattr(args, name)])
+    base = [{}]
+    if args.configs:
+        with open(args.configs) as f:
+            base = json.load(f)
+        if not isinstance(base, list):
+            parser.error(f"{args.configs} must hold a list of settings dicts")
+    try:
+        configs = build_configs(args.scene, base, vary)
+    except ValueError as error:
+        parser.error(f"{args.configs}: {error}" if args.configs else str(error))
+    if any(c["engine"] == "parallel" for c in configs):
+        parser.error("the parallel engine cannot run inside the sweep's worker processes; "
+                     "the sweep is parallel across runs already")
+
+    os.makedirs(args.cache, exist_ok=True)
+    results = {}
+    todo = []
+    for config in configs:
+        key = config_key(config)
+        metrics = load_cached(args.cache, config)
+        if metrics is None:
+            todo.append(config)
+        results[key] = (config, metrics)
+    print(f"{len(configs)} configurations, {len(configs) - len(todo)} cached, "
+          f"{len(todo)} to run")
+
+    workers = args.workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    if todo:
+        with multiprocessing.Pool(min(workers, len(todo))) as pool:
+            for done, (config, metrics) in enumerate(pool.imap_unordered(run_config, todo), 1):
+                store(args.cache, config, metrics)
+                results[config_key(config)] = (config, metrics)
+                print(f"{done}/{len(todo)} runs ({metrics['wall_time']:.1f} s, "
+                      f"energy drift {metrics['energy_drift']:+.2e})", flush=True)
+    print(f"Sweep finished in {time.perf_counter() - t0:.1f} s with {workers} workers")
+
+    rows = [{**config, **metrics} for config, metrics in results.values()]
+    columns = list(dict.fromkeys(name for row in rows for name in row))
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Results of {len(rows)} runs written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
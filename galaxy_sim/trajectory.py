@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming trajectory files.
+
+``TrajectoryWriter`` records the bodies every ``every`` steps. Frames are
+copied (optionally downcast to float32) in the calling thread and handed to
+a background thread through a bounded queue, so the physics loop never waits
+for the disk; if the queue is full the frame is dropped and counted instead
+(or, with ``drop=False`` for batch runs that must keep every frame, the
+caller waits for room).
+
+File layout, all little-endian:
+
+    header   b"GALTRAJ1", uint32 version, uint32 bytes per value (4 or 8)
+    chunk    b"CHNK", uint32 frames, uint32 bodies, int64 step[frames],
+             float64 masses[bodies], values[frames, bodies, 4] (x, y, vx, vy)
+    ...
+    index    b"INDX", uint64 frames, then per frame int64
+             (data offset, step, bodies, masses offset)
+    trailer  uint64 index offset, b"GTEND"
+
+A chunk holds consecutive frames with the same bodies; a new one starts when
+it reaches ``CHUNK_BYTES`` or the body set changes (restart, +/-). The index
+is written by ``close()``; ``Trajectory`` uses it for random access to any
+frame and, for a file whose run never closed it, rebuilds it by hopping
+from chunk header to chunk header.
+"""
+
+import atexit
+import queue
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"GALTRAJ1"
+VERSION = 1
+CHUNK_BYTES = 8 << 20      # target size of the frame data in one chunk
+QUEUE_FRAMES = 16          # frames waiting for the writer thread before dropping
+
+_HEADER = struct.Struct("<II")
+_CHUNK = struct.Struct("<4sII")
+_TRAILER = struct.Struct("<Q5s")
+
+
+class TrajectoryWriter:
+    """Append frames to a trajectory file from a background thread."""
+
+    def __init__(self, path, every=1, float32=False, drop=True, queue_frames=QUEUE_FRAMES):
+        self.path = path
+        self.every = max(1, every)
+        self.drop = drop
+        self.dtype = np.dtype("<f4" if float32 else "<f8")
+        self.dropped = 0
+        self.frames = 0
+        self.queue = queue.Queue(maxsize=queue_frames)
+        self.file = open(path, "wb")
+        self.file.write(MAGIC + _HEADER.pack(VERSION, self.dtype.itemsize))
+        self.index = []
+        self.thread = threading.Thread(target=self._run, name="trajectory-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, step, positions, velocities, masses):
+        """Queue the frame of ``step`` if it falls on the recording interval."""
+        if self.file is None or step % self.every:
+            return
+        frame = np.empty((len(positions), 4), dtype=self.dtype)
+        frame[:, :2] = positions
+        frame[:, 2:] = velocities
+        try:
+            self.queue.put((step, frame, np.array(masses, dtype="<f8")), block=not self.drop)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        pending = []                       # frames of the chunk being collected
+        while True:
+            item = self.queue.get()
+            if item is not None and pending:
+                same = (len(item[2]) == len(pending[0][2])
+                        and np.array_equal(item[2], pending[0][2]))
+                full = len(pending) * pending[0][1].nbytes >= CHUNK_BYTES
+                if not same or full:
+                    self._write_chunk(pending)
+                    pending = []
+            if item is None:
+                if pending:
+                    self._write_chunk(pending)
+                return
+            pending.append(item)
+
+    def _write_chunk(self, frames):
+        f = self.file
+        masses = frames[0][2]
+        steps = np.array([step for step, _, _ in frames], dtype="<i8")
+        f.write(_CHUNK.pack(b"CHNK", len(frames), len(masses)))
+        f.write(steps.tobytes())
+        masses_offset = f.tell()
+        f.write(masses.tobytes())
+        for step, frame, _ in frames:
+            self.index.append((f.tell(), step, len(masses), masses_offset))
+            f.write(frame.tobytes())
+        self.frames += len(frames)
+
+    def close(self):
+        """Flush the queued frames, write the index and close the file."""
+        if self.file is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        f = self.file
+        index_offset = f.tell()
+        f.write(b"INDX" + struct.pack("<Q", len(self.index)))
+        f.write(np.array(self.index, dtype="<i8").reshape(-1, 4).tobytes())
+        f.write(_TRAILER.pack(index_offset, b"GTEND"))
+        f.close()
+        self.file = None
+        if self.dropped:
+            print(f"Trajectory {self.path}: {self.dropped} frames dropped (disk too slow)")
+
+
+class Trajectory:
+    """Random-access reader for files written by ``TrajectoryWriter``.
+
+    ``traj[k]`` returns ``(step, positions, velocities, masses)`` of frame k;
+    ``traj.steps`` holds the step of every frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a trajectory file")
+            version, itemsize = _HEADER.unpack(f.read(_HEADER.size))
+            if version != VERSION:
+                raise ValueError(f"{path}: unsupported trajectory version {version}")
+            self.dtype = np.dtype("<f4" if itemsize == 4 else "<f8")
+            self.index = self._read_index(f)
+        self.steps = self.index[:, 1].copy()
+
+    def _read_index(self, f):
+        f.seek(0, 2)
+        size = f.tell()
+        if size >= len(MAGIC) + _HEADER.size + _TRAILER.size:
+            f.seek(size - _TRAILER.size)
+            index_offset, end = _TRAILER.unpack(f.read(_TRAILER.size))
+            if end == b"GTEND":
+                f.seek(index_offset + 4)
+                count, = struct.unpack("<Q", f.read(8))
+                return np.fromfile(f, dtype="<i8", count=4 * count).reshape(count, 4)
+        return self._scan(f, size)
+
+    def _scan(self, f, size):
+        # Unclosed file: walk the chunk headers and index every complete frame
+        rows = []
+        offset = len(MAGIC) + _HEADER.size
+        while offset + _CHUNK.size <= size:
+            f.seek(offset)
+            tag, frames, bodies = _CHUNK.unpack(f.read(_CHUNK.size))
+            if tag != b"CHNK":
+                break
+            steps = np.fromfile(f, dtype="<i8", count=frames)
+            masses_offset = offset + _CHUNK.size + 8 * frames
+            data = masses_offset + 8 * bodies
+            frame_bytes = bodies * 4 * self.dtype.itemsize
+            for k in range(len(steps)):
+                if data + (k + 1) * frame_bytes > size:
+                    break
+                rows.append((data + k * frame_bytes, steps[k], bodies, masses_offset))
+            offset = data + frames * frame_bytes
+        return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, k):
+        data_offset, step, bodies, masses_offset = (int(v) for v in self.index[k])
+        with open(self.path, "rb") as f:
+            f.seek(masses_offset)
+            masses = np.fromfile(f, dtype="<f8", count=bodies)
+            f.seek(data_offset)
+            values = np.fromfile(f, dtype=self.dtype, count=4 * bodies).reshape(bodies, 4)
+        return step, values[:, :2], values[:, 2:], masses
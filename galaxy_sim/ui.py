@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Per-frame UI caching for the pygame scripts.
+
+    TextCache    ``font.render`` results kept by string, so HUD text that did
+                 not change since an earlier frame is not rendered again
+    StaticLayer  the buttons and labels, painted once into an off-screen
+                 surface and copied to the screen each frame
+    DirtyScreen  erases and pushes to the display only the regions drawn in
+                 the previous and the current frame instead of the whole window
+"""
+
+import pygame
+
+
+class TextCache:
+    """Rendered text surfaces by string."""
+
+    def __init__(self, font, color=(255, 255, 255), limit=256):
+        self.font = font
+        self.color = color
+        self.limit = limit
+        self.surfaces = {}
+
+    def render(self, text):
+        surface = self.surfaces.get(text)
+        if surface is None:
+            if len(self.surfaces) >= self.limit:
+                self.surfaces.clear()          # HUD numbers drift; start over
+            surface = self.surfaces[text] = self.font.render(text, True, self.color)
+        return surface
+
+
+class StaticLayer:
+    """Controls painted once and blitted every frame.
+
+    ``paint(surface)`` draws the controls onto the given surface and returns
+    the rectangles they cover; only those parts are copied to the screen.
+    Call ``invalidate()`` when the controls change.
+    """
+
+    def __init__(self, size, paint):
+        self.size = size
+        self.paint = paint
+        self.surface = None
+        self.rects = []
+
+    def invalidate(self):
+        self.surface = None
+
+    def blit(self, screen):
+        if self.surface is None:
+            self.surface = pygame.Surface(self.size, 0, screen)   # same pixel format: plain copies
+            self.rects = [pygame.Rect(r) for r in self.paint(self.surface)]
+        screen.blits([(self.surface, rect, rect) for rect in self.rects], doreturn=False)
+        return self.rects
+
+
+class DirtyScreen:
+    """Clears and updates only what was drawn, frame to frame.
+
+    Between ``begin()`` and ``end()`` every drawn region is reported with
+    ``add()``. ``begin()`` clears the regions of the previous frame; ``end()``
+    updates the display where the previous and the current frame drew. After
+    ``invalidate()`` (e.g. returning from the settings screen) the next frame
+    clears and flips the whole window.
+    """
+
+    def __init__(self, screen, background=(0, 0, 0)):
+        self.screen = screen
+        self.background = background
+        self.full = True
+        self.previous = []
+        self.current = []
+
+    def invalidate(self):
+        self.full = True
+
+    def begin(self):
+        if self.full:
+            self.screen.fill(self.background)
+        else:
+            for rect in self.previous:
+                self.screen.fill(self.background, rect)
+
+    def add(self, *rects):
+        self.current.extend(r for r in rects if r)
+
+    def end(self):
+        if self.full:
+            pygame.display.flip()
+            self.full = False
+        else:
+            pygame.display.update(self.previous + self.current)
+        self.previous, self.current = self.current, []
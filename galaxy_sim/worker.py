@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Physics on a background thread, decoupled from drawing.
+
+``PhysicsWorker`` calls the script's step function ``substeps`` times per
+displayed frame on its own thread and then publishes a snapshot of the
+bodies. The render loop asks for the next batch with ``request()`` and
+draws the newest snapshot, so a slow force pass delays only the picture,
+never the event handling. A batch runs at most once per request: physics
+faster than the display waits for the next frame instead of running ahead,
+physics slower than it runs back to back and the frames in between repeat
+(or, with ``interpolate()``, blend) the last snapshots.
+
+Snapshots are ``(time, positions, data)`` copies made by the worker and
+never written again. The last two are kept as one ``(previous, latest)``
+pair that is replaced by a single assignment, so drawing reads them without
+holding a lock.
+
+The main thread changes the simulation state (restart, +/-, loading a
+checkpoint) only inside ``with worker.hold():``, which waits for the batch
+in progress and publishes the new state on exit.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PhysicsWorker:
+    """Runs batches of physics steps on a thread and publishes snapshots.
+
+    ``step()`` advances the simulation by one step; ``snapshot()`` returns
+    ``(positions, data)``, copies of what the renderer needs. With
+    ``threaded=False`` every ``request()`` runs its batch in the caller, as
+    the scripts did before.
+    """
+
+    def __init__(self, step, snapshot, substeps=1, threaded=True):
+        self.step = step
+        self.snapshot = snapshot
+        self.substeps = max(1, int(substeps))
+        self.lock = threading.Lock()        # held while the state is changing
+        self.wanted = threading.Event()
+        self.running = True
+        self.error = None
+        self.frames = (None, None)          # (previous, latest)
+        self.publish(keep_previous=False)
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self._run, name="physics", daemon=True)
+            self.thread.start()
+
+    def publish(self, keep_previous=True):
+        """Make the current state the latest snapshot (call with the state held)."""
+        positions, data = self.snapshot()
+        frame = (time.perf_counter(), positions, data)
+        latest = self.frames[1]
+        self.frames = (latest if keep_previous and latest is not None else frame, frame)
+
+    def _batch(self):
+        with self.lock:
+            for _ in range(self.substeps):
+                self.step()
+            self.publish()
+
+    def _run(self):
+        try:
+            while True:
+                self.wanted.wait()
+                self.wanted.clear()
+                if not self.running:
+                    return
+                self._batch()
+        except BaseException as e:       # handed to the main thread by request()
+            self.error = e
+
+    def request(self):
+        """Ask for the next batch of substeps."""
+        if self.error is not None:
+            raise RuntimeError("physics step failed") from self.error
+        if self.thread is None:
+            self._batch()
+        else:
+            self.wanted.set()
+
+    @contextmanager
+    def hold(self):
+        """Pause the worker while the main thread replaces or edits the state.
+
+        The state published on exit starts a new snapshot pair, so nothing is
+        interpolated across a restart.
+        """
+        with self.lock:
+            yield
+            self.publish(keep_previous=False)
+
+    def latest(self):
+        """The newest snapshot ``(time, positions, data)``."""
+        return self.frames[1]
+
+    def interpolate(self, now=None):
+        """Positions blended between the last two snapshots.
+
+        The picture runs one batch behind the physics: it shows the previous
+        snapshot when the latest one is published and reaches the latest one
+        after the time the last batch took, which keeps the motion smooth
+        when a batch spans several frames.
+        """
+        previous, latest = self.frames
+        if previous is latest or len(previous[1]) != len(latest[1]):
+            return latest[1]
+        span = latest[0] - previous[0]
+        now = time.perf_counter() if now is None else now
+        alpha = min(1.0, (now - latest[0]) / span) if span > 0 else 1.0
+        return previous[1] + (latest[1] - previous[1]) * alpha
+
+    def stop(self):
+        """Finish the batch in progress and end the thread."""
+        self.running = False
+        self.wanted.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None